@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark da recuperação de trechos de PDF contra o envio do texto inteiro
+Para cada pergunta compara o tamanho do contexto (tokens estimados ou, com
+--count-tokens, contados pela API) e o tempo de montagem. Com --claude, envia
+as duas versões ao Claude e mede latência e tokens de entrada reais.
+
+Uso:
+    python benchmark_retrieval.py extrato.pdf
+    python benchmark_retrieval.py extrato.pdf --questions "Qual o saldo?,Quais as taxas?" --claude
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from pdf_utils import extract_text_from_file
+from retrieval import BM25Index, chunk_text, estimate_tokens, select_context
+
+load_dotenv()
+
+DEFAULT_QUESTIONS = [
+    "Qual a rentabilidade no período?",
+    "Quais taxas foram cobradas?",
+    "Qual o saldo final da carteira?",
+    "Analise o conteúdo do PDF anexado."
+]
+
+MODEL = "claude-3-opus-20240229"
+
+def build_content(question, pdf_context):
+    return f"{question}\n\nConteúdo do PDF:\n{pdf_context}"
+
+def count_tokens(client, content):
+    result = client.messages.count_tokens(model=MODEL, messages=[{"role": "user", "content": content}])
+    return result.input_tokens
+
+def ask_claude(client, content):
+    started = time.time()
+    response = client.messages.create(
+        model=MODEL,
+        max_tokens=512,
+        messages=[{"role": "user", "content": content}]
+    )
+    return time.time() - started, response.usage.input_tokens
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da recuperação em PDFs")
+    parser.add_argument('pdf', help="caminho do PDF")
+    parser.add_argument('--questions', default=','.join(DEFAULT_QUESTIONS), help="perguntas separadas por vírgula")
+    parser.add_argument('--count-tokens', action='store_true', help="conta tokens pela API em vez de estimar")
+    parser.add_argument('--claude', action='store_true', help="envia as duas versões ao Claude (gasta tokens)")
+    args = parser.parse_args()
+
+    print("=== Benchmark de Recuperação em PDF - Horizont IA ===")
+    print(f"Iniciado em: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    started = time.perf_counter()
+    text = extract_text_from_file(args.pdf)
+    extract_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = BM25Index(chunk_text(text))
+    index_time = time.perf_counter() - started
+
+    print(f"PDF: {args.pdf} | {len(text)} caracteres | ~{estimate_tokens(text)} tokens")
+    print(f"Extração: {extract_time:.2f}s | índice: {len(index.chunks)} trechos em {index_time * 1000:.1f}ms")
+    print()
+
+    client = None
+    if args.count_tokens or args.claude:
+        import anthropic
+        client = anthropic.Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
+
+    for question in [q.strip() for q in args.questions.split(',') if q.strip()]:
+        started = time.perf_counter()
+        context = select_context(text, question)
+        select_time = time.perf_counter() - started
+
+        full_content = build_content(question, text)
+        retrieved_content = build_content(question, context)
+        if args.count_tokens:
+            full_tokens = count_tokens(client, full_content)
+            retrieved_tokens = count_tokens(client, retrieved_content)
+        else:
+            full_tokens = estimate_tokens(full_content)
+            retrieved_tokens = estimate_tokens(retrieved_content)
+
+        print(f"Pergunta: {question}")
+        print(f"  texto inteiro: {full_tokens} tokens | "
+              f"recuperação: {retrieved_tokens} tokens ({retrieved_tokens / full_tokens:.0%}) "
+              f"em {select_time * 1000:.1f}ms")
+
+        if args.claude:
+            full_latency, full_input = ask_claude(client, full_content)
+            retrieved_latency, retrieved_input = ask_claude(client, retrieved_content)
+            print(f"  Claude texto inteiro: {full_latency:.2f}s, {full_input} tokens de entrada")
+            print(f"  Claude recuperação:   {retrieved_latency:.2f}s, {retrieved_input} tokens de entrada")
+
+if __name__ == "__main__":
+    main()
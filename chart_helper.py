@@ -1,5 +1,22 @@
 import json
-from typing import Dict, Any, Optional
+import math
+from typing import Dict, Any, List, Optional, Sequence, Union
+
+import numpy as np
+
+# Taxas anuais em %; produtos com monthlyRate rendem por mês (ex.: Horizont Smart)
+DEFAULT_PRODUCTS = {
+    "Poupança": {"rate": 7.75, "yearlyMultiplier": 1.0775},
+    "CDI": {"rate": 10.88, "yearlyMultiplier": 1.1088},
+    "Horizont Smart": {"rate": 15.39, "monthlyRate": 0.012, "yearlyMultiplier": 1.1539},
+    "Horizont Trend": {"rate": 19.37, "yearlyMultiplier": 1.1937},
+    "Horizont Leverage": {"rate": 26.82, "monthlyRate": 0.02, "yearlyMultiplier": 1.2682}
+}
+
+# Limites do motor de projeção (evitam matrizes gigantes vindas da API)
+MAX_YEARS = 50
+MAX_INITIAL_VALUES = 100
+MAX_PRODUCTS = 20
 
 def create_comparison_chart(initial_value: float, years: int = 5, products: Optional[Dict[str, Dict[str, float]]] = None) -> str:
     """
@@ -14,19 +31,15 @@ def create_comparison_chart(initial_value: float, years: int = 5, products: Opti
         String JSON formatada entre tags [GRAFICO_DADOS]
     """
     if products is None:
-        products = {
-            "Poupança": {"rate": 7.75, "yearlyMultiplier": 1.0775},
-            "CDI": {"rate": 10.88, "yearlyMultiplier": 1.1088},
-            "Horizont Smart": {"rate": 15.39, "monthlyRate": 0.012, "yearlyMultiplier": 1.1539},
-            "Horizont Trend": {"rate": 19.37, "yearlyMultiplier": 1.1937}
-        }
+        products = DEFAULT_PRODUCTS
     
     chart_data = {
         "type": "comparison",
         "title": "Comparativo de Investimentos",
         "years": years,
         "initialValue": initial_value,
-        "products": products
+        "products": products,
+        "series": project_series(initial_value, years, products)
     }
     
     return f"[GRAFICO_DADOS]\n{json.dumps(chart_data, indent=2, ensure_ascii=False)}\n[/GRAFICO_DADOS]"
@@ -47,7 +60,7 @@ def create_product_chart(product_name: str, initial_value: float, years: int = 5
     """
     if monthly_rate:
         yearly_multiplier = (1 + monthly_rate) ** 12
-        rate = monthly_rate * 100 * 12
+        rate = (yearly_multiplier - 1) * 100  # Taxa anual equivalente, capitalizada mês a mês
     elif yearly_rate:
         yearly_multiplier = 1 + (yearly_rate / 100)
         rate = yearly_rate
@@ -69,7 +82,8 @@ def create_product_chart(product_name: str, initial_value: float, years: int = 5
         "title": f"Projeção - {product_name}",
         "years": years,
         "initialValue": initial_value,
-        "products": products
+        "products": products,
+        "series": project_series(initial_value, years, products)
     }
     
     return f"[GRAFICO_DADOS]\n{json.dumps(chart_data, indent=2, ensure_ascii=False)}\n[/GRAFICO_DADOS]"
@@ -78,4 +92,363 @@ def format_chart_example() -> str:
     """
     Retorna um exemplo formatado de como gerar um gráfico.
     """
-    return create_comparison_chart(500000, 5) 
\ No newline at end of file
+    return create_comparison_chart(500000, 5) 
+
+
+def monthly_multipliers(products: Dict[str, Dict[str, float]]) -> np.ndarray:
+    """
+    Multiplicador mensal de cada produto, na ordem do dicionário.
+    
+    Produtos com monthlyRate capitalizam a taxa mensal; os demais usam a taxa
+    anual (rate, em %) convertida para a mensal equivalente.
+    
+    Raises:
+        ValueError: produto que não é dicionário ou taxa ausente, não numérica,
+            infinita ou que zera o investimento
+    """
+    multipliers = []
+    for name, product in products.items():
+        if not isinstance(product, dict):
+            raise ValueError(f"Produto {name}: informe um objeto com rate ou monthlyRate")
+        if product.get("monthlyRate") is not None:
+            multiplier = 1 + _finite_number(product["monthlyRate"], f"monthlyRate de {name}")
+        elif product.get("rate") is not None:
+            annual = 1 + _finite_number(product["rate"], f"rate de {name}") / 100
+            multiplier = annual ** (1 / 12) if annual > 0 else 0.0
+        else:
+            raise ValueError(f"Produto sem taxa: {name}")
+        if multiplier <= 0:
+            raise ValueError(f"Taxa de {name} fora dos limites")
+        multipliers.append(multiplier)
+    return np.array(multipliers, dtype=float)
+
+def _finite_number(value: Any, label: str) -> float:
+    """Converte para float, recusando textos, booleanos, NaN e infinito."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{label} deve ser numérico")
+    if not math.isfinite(value):
+        raise ValueError(f"{label} deve ser um número finito")
+    return float(value)
+
+def project(initial_values: Union[float, Sequence[float]], years: int,
+            products: Optional[Dict[str, Dict[str, float]]] = None) -> np.ndarray:
+    """
+    Calcula de uma vez os valores mês a mês de todos os produtos e valores iniciais.
+    
+    Args:
+        initial_values: Valor inicial ou lista de valores iniciais
+        years: Horizonte da projeção em anos
+        products: Dicionário com produtos e suas taxas. Se None, usa produtos padrão.
+    
+    Returns:
+        Matriz (valores iniciais x produtos x meses + 1); a coluna 0 é o valor inicial
+    """
+    if products is None:
+        products = DEFAULT_PRODUCTS
+    
+    initial = np.atleast_1d(np.asarray(initial_values, dtype=float))
+    months = np.arange(int(years) * 12 + 1)
+    # Estouro vira inf, que build_projections recusa
+    with np.errstate(over='ignore'):
+        factors = monthly_multipliers(products)[:, np.newaxis] ** months[np.newaxis, :]
+        return initial[:, np.newaxis, np.newaxis] * factors[np.newaxis, :, :]
+
+def project_series(initial_value: float, years: int, products: Optional[Dict[str, Dict[str, float]]] = None,
+                   frequency: str = "monthly") -> Dict[str, List[float]]:
+    """
+    Série de valores de cada produto para um único valor inicial, arredondada em centavos.
+    """
+    if products is None:
+        products = DEFAULT_PRODUCTS
+    step = 12 if frequency == "yearly" else 1
+    values = np.round(project(initial_value, years, products)[0, :, ::step], 2)
+    return {name: values[i].tolist() for i, name in enumerate(products)}
+
+def build_projections(initial_values: Sequence[float], horizons: Sequence[int],
+                      products: Optional[Dict[str, Dict[str, float]]] = None,
+                      frequency: str = "monthly") -> List[Dict[str, Any]]:
+    """
+    Projeções para todas as combinações de valor inicial e horizonte.
+    
+    A matriz é calculada uma vez até o maior horizonte e fatiada para os demais.
+    
+    Returns:
+        Lista de dicionários no formato do gráfico ([GRAFICO_DADOS]), com
+        `series` (valores por período) e `finalValues` (valor no fim do horizonte)
+    
+    Raises:
+        ValueError: parâmetros fora dos limites
+    """
+    if products is None:
+        products = DEFAULT_PRODUCTS
+    if frequency not in ("monthly", "yearly"):
+        raise ValueError("frequency deve ser 'monthly' ou 'yearly'")
+    if not products or len(products) > MAX_PRODUCTS:
+        raise ValueError(f"Informe de 1 a {MAX_PRODUCTS} produtos")
+    if not initial_values or len(initial_values) > MAX_INITIAL_VALUES:
+        raise ValueError(f"Informe de 1 a {MAX_INITIAL_VALUES} valores iniciais")
+    if any(not math.isfinite(value) or value <= 0 for value in initial_values):
+        raise ValueError("Valores iniciais devem ser números positivos e finitos")
+    if not horizons or any(not 1 <= years <= MAX_YEARS for years in horizons):
+        raise ValueError(f"Horizontes devem estar entre 1 e {MAX_YEARS} anos")
+    
+    values = np.round(project(initial_values, max(horizons), products), 2)
+    if not np.isfinite(values).all():
+        raise ValueError("Projeção fora dos limites numéricos; reduza valores, taxas ou horizonte")
+    step = 12 if frequency == "yearly" else 1
+    names = list(products)
+    
+    projections = []
+    for v, initial_value in enumerate(initial_values):
+        for years in horizons:
+            window = values[v, :, :years * 12 + 1:step]
+            projections.append({
+                "type": "comparison" if len(names) > 1 else "single",
+                "title": "Comparativo de Investimentos" if len(names) > 1 else f"Projeção - {names[0]}",
+                "years": years,
+                "initialValue": initial_value,
+                "frequency": frequency,
+                "products": products,
+                "series": {name: window[i].tolist() for i, name in enumerate(names)},
+                "finalValues": {name: float(values[v, i, years * 12]) for i, name in enumerate(names)}
+            })
+    return projections
+
+# Ferramentas (tool use) oferecidas ao Claude: em vez de escrever o JSON do
+# gráfico token a token, o modelo chama a ferramenta com poucos parâmetros e o
+# servidor monta o bloco [GRAFICO_DADOS] localmente.
+CHART_TOOLS = [
+    {
+        "name": "grafico_comparativo",
+        "description": "Gera um gráfico comparando a evolução de um valor investido em vários produtos "
+                       "(Poupança, CDI, Horizont Smart, Horizont Trend, Horizont Leverage). Use sempre que o cliente pedir "
+                       "uma comparação ou simulação entre produtos.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "initial_value": {"type": "number", "description": "Valor inicial em reais"},
+                "years": {"type": "integer", "minimum": 1, "maximum": MAX_YEARS, "description": "Horizonte em anos"},
+                "products": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": list(DEFAULT_PRODUCTS)},
+                    "description": "Produtos a comparar; omita para usar todos"
+                }
+            },
+            "required": ["initial_value", "years"]
+        }
+    },
+    {
+        "name": "grafico_produto",
+        "description": "Gera um gráfico da evolução de um valor investido em um único produto, "
+                       "com taxa mensal ou anual.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "product_name": {"type": "string"},
+                "initial_value": {"type": "number", "description": "Valor inicial em reais"},
+                "years": {"type": "integer", "minimum": 1, "maximum": MAX_YEARS, "description": "Horizonte em anos"},
+                "monthly_rate": {"type": "number", "description": "Taxa mensal em decimal (ex.: 0.012 para 1,2% a.m.)"},
+                "yearly_rate": {"type": "number", "description": "Taxa anual em % (ex.: 10.88)"}
+            },
+            "required": ["product_name", "initial_value", "years"]
+        }
+    }
+]
+
+def run_chart_tool(name: str, tool_input: Dict[str, Any]) -> str:
+    """
+    Executa uma chamada de ferramenta do Claude.
+    
+    Returns:
+        Bloco [GRAFICO_DADOS] pronto para ser anexado à resposta
+    
+    Raises:
+        ValueError: ferramenta desconhecida ou parâmetros inválidos
+    """
+    initial_value = float(tool_input["initial_value"])
+    years = int(tool_input["years"])
+    if initial_value <= 0 or not 1 <= years <= MAX_YEARS:
+        raise ValueError("Parâmetros do gráfico fora dos limites")
+    
+    if name == "grafico_comparativo":
+        names = tool_input.get("products") or list(DEFAULT_PRODUCTS)
+        unknown = [product for product in names if product not in DEFAULT_PRODUCTS]
+        if unknown:
+            raise ValueError(f"Produtos desconhecidos: {', '.join(unknown)}")
+        return create_comparison_chart(initial_value, years, {product: DEFAULT_PRODUCTS[product] for product in names})
+    
+    if name == "grafico_produto":
+        return create_product_chart(
+            tool_input["product_name"],
+            initial_value,
+            years,
+            monthly_rate=tool_input.get("monthly_rate"),
+            yearly_rate=tool_input.get("yearly_rate")
+        )
+    
+    raise ValueError(f"Ferramenta desconhecida: {name}")
+
+CHART_OPEN_TAG = "[GRAFICO_DADOS]"
+CHART_CLOSE_TAG = "[/GRAFICO_DADOS]"
+CHART_TYPES = ("comparison", "single")
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _strip_json_comments(raw: str) -> str:
+    """Remove comentários `//` fora de strings (o formato do prompt usa comentários)."""
+    result = []
+    in_string = escaped = False
+    i = 0
+    while i < len(raw):
+        char = raw[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif raw.startswith("//", i):
+            end = raw.find("\n", i)
+            i = len(raw) if end == -1 else end
+            continue
+        result.append(char)
+        i += 1
+    return "".join(result)
+
+def validate_chart(chart: Any) -> Dict[str, Any]:
+    """
+    Confere um bloco de gráfico contra o esquema esperado pelo frontend.
+    
+    Returns:
+        O próprio dicionário, se válido
+    
+    Raises:
+        ValueError: descrição do primeiro problema encontrado
+    """
+    if not isinstance(chart, dict):
+        raise ValueError("gráfico deve ser um objeto")
+    for field in ("type", "title", "years", "initialValue", "products"):
+        if field not in chart:
+            raise ValueError(f"campo obrigatório ausente: {field}")
+    if chart["type"] not in CHART_TYPES:
+        raise ValueError(f"type inválido: {chart['type']}")
+    if not isinstance(chart["title"], str):
+        raise ValueError("title deve ser texto")
+    if not _is_number(chart["years"]) or not 0 < chart["years"] <= MAX_YEARS:
+        raise ValueError("years fora dos limites")
+    if not _is_number(chart["initialValue"]) or chart["initialValue"] <= 0:
+        raise ValueError("initialValue deve ser positivo")
+    products = chart["products"]
+    if not isinstance(products, dict) or not products:
+        raise ValueError("products deve ser um objeto não vazio")
+    for name, product in products.items():
+        if not isinstance(product, dict) or not any(
+                _is_number(product.get(field)) for field in ("rate", "monthlyRate")):
+            raise ValueError(f"produto sem rate ou monthlyRate numérico: {name}")
+    series = chart.get("series")
+    if series is not None:
+        if not isinstance(series, dict) or not all(
+                isinstance(values, list) and all(_is_number(v) for v in values) for values in series.values()):
+            raise ValueError("series deve mapear produto -> lista de números")
+    return chart
+
+class ChartStreamParser:
+    """
+    Separa os blocos [GRAFICO_DADOS] de um texto que chega em pedaços.
+    
+    `feed` devolve eventos ("text", str) e ("chart", dict) na ordem do texto.
+    O texto é liberado assim que não pode mais ser o início de uma tag, e cada
+    gráfico sai assim que sua tag de fechamento chega. Comentários `//` no JSON
+    são aceitos. Blocos com JSON inválido ou fora do esquema saem como
+    ("rejected", bloco original com as tags), para serem mostrados como texto,
+    e o motivo fica em `rejected`.
+    """
+    
+    def __init__(self):
+        self._buffer = ""
+        self._in_chart = False
+        self.charts: List[Dict[str, Any]] = []
+        self.rejected: List[str] = []
+    
+    def feed(self, chunk: str) -> List[tuple]:
+        self._buffer += chunk
+        events = []
+        while True:
+            if self._in_chart:
+                end = self._buffer.find(CHART_CLOSE_TAG)
+                if end == -1:
+                    break
+                raw = self._buffer[:end]
+                self._buffer = self._buffer[end + len(CHART_CLOSE_TAG):]
+                self._in_chart = False
+                try:
+                    chart = validate_chart(json.loads(_strip_json_comments(raw)))
+                except ValueError as e:  # json.JSONDecodeError é subclasse de ValueError
+                    self.rejected.append(f"{e}")
+                    events.append(("rejected", f"{CHART_OPEN_TAG}{raw}{CHART_CLOSE_TAG}"))
+                    continue
+                self.charts.append(chart)
+                events.append(("chart", chart))
+            else:
+                start = self._buffer.find(CHART_OPEN_TAG)
+                if start == -1:
+                    # Segurar um possível começo de tag no fim do buffer
+                    keep = self._partial_tag_length()
+                    text, self._buffer = self._buffer[:len(self._buffer) - keep], self._buffer[len(self._buffer) - keep:]
+                    if text:
+                        events.append(("text", text))
+                    break
+                if start:
+                    events.append(("text", self._buffer[:start]))
+                self._buffer = self._buffer[start + len(CHART_OPEN_TAG):]
+                self._in_chart = True
+        return events
+    
+    def _partial_tag_length(self) -> int:
+        for size in range(min(len(CHART_OPEN_TAG) - 1, len(self._buffer)), 0, -1):
+            if CHART_OPEN_TAG.startswith(self._buffer[-size:]):
+                return size
+        return 0
+    
+    def close(self) -> List[tuple]:
+        """Libera o que sobrou; um bloco sem fechamento volta como texto."""
+        rest = self._buffer
+        if self._in_chart:
+            rest = CHART_OPEN_TAG + rest
+        self._buffer = ""
+        self._in_chart = False
+        return [("text", rest)] if rest else []
+
+def extract_charts(text: str) -> tuple:
+    """
+    Separa uma resposta completa em (texto sem os blocos, lista de gráficos válidos).
+    
+    Blocos inválidos continuam no texto como vieram.
+    """
+    parser = ChartStreamParser()
+    events = parser.feed(text or "") + parser.close()
+    clean_text = "".join(value for kind, value in events if kind != "chart")
+    return clean_text.strip(), parser.charts
+
+def compact_chart_blocks(text: str) -> str:
+    """
+    Reescreve os blocos [GRAFICO_DADOS] em JSON compacto e sem `series`.
+    
+    Usado no histórico enviado ao Claude: os parâmetros do gráfico continuam
+    disponíveis para referência, sem pagar tokens pelas séries calculadas.
+    Blocos que não passam na validação ficam como estão.
+    """
+    if CHART_OPEN_TAG not in (text or ""):
+        return text
+    parser = ChartStreamParser()
+    parts = []
+    for kind, value in parser.feed(text) + parser.close():
+        if kind == "chart":
+            compact = {key: item for key, item in value.items() if key not in ("series", "finalValues")}
+            value = f"{CHART_OPEN_TAG}{json.dumps(compact, ensure_ascii=False, separators=(',', ':'))}{CHART_CLOSE_TAG}"
+        parts.append(value)
+    return "".join(parts)
@@ -0,0 +1,189 @@
+"""
+Memória da conversa com orçamento de tokens.
+
+O contexto enviado ao Claude é o resumo dos turnos antigos (guardado em
+chats.context) mais as mensagens mais recentes que couberem no orçamento.
+Quando mensagens saem da janela, uma thread as incorpora ao resumo usando só
+o resumo anterior e os turnos novos, sem reler o histórico inteiro; o resumo
+guarda até qual mensagem já foi incorporado (summary_through_id) e chats
+antigos são alcançados em lotes, da mensagem mais antiga para a mais nova.
+Assim os tokens de entrada por pedido ficam estáveis conforme o chat cresce.
+"""
+
+import logging
+import os
+import threading
+
+from chart_helper import compact_chart_blocks
+from database import get_chat_context, get_chat_messages_after, get_recent_chat_messages, update_chat_summary
+from retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_HISTORY_TOKENS = int(os.getenv('CONTEXT_HISTORY_TOKENS', 2000))  # Orçamento do histórico recente
+CONTEXT_MAX_MESSAGES = int(os.getenv('CONTEXT_MAX_MESSAGES', 20))  # Mensagens lidas do banco no máximo
+CONTEXT_SUMMARY_ENABLED = os.getenv('CONTEXT_SUMMARY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CONTEXT_SUMMARY_MODEL = os.getenv('CONTEXT_SUMMARY_MODEL', 'claude-3-haiku-20240307')
+CONTEXT_SUMMARY_TOKENS = int(os.getenv('CONTEXT_SUMMARY_TOKENS', 400))  # Tamanho máximo do resumo
+
+# Cada mensagem entra no resumo com no máximo este tamanho
+SUMMARY_MESSAGE_CHARS = 2000
+# Mensagens incorporadas ao resumo por chamada ao modelo
+SUMMARY_BATCH = 40
+# Lotes por atualização; o que faltar fica para o próximo turno
+SUMMARY_MAX_BATCHES = 5
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Você resume conversas entre um consultor da Horizont Investimentos e o assistente. "
+    "Mantenha nomes de clientes, valores, prazos, produtos e conclusões que possam ser "
+    "retomados depois. Responda só com o resumo, em português, em tópicos curtos."
+)
+
+class ConversationMemory:
+    def __init__(self, client_factory, history_tokens=CONTEXT_HISTORY_TOKENS, max_messages=CONTEXT_MAX_MESSAGES,
+                 summary_enabled=CONTEXT_SUMMARY_ENABLED, summary_model=CONTEXT_SUMMARY_MODEL,
+                 summary_tokens=CONTEXT_SUMMARY_TOKENS, scheduler_call=None):
+        """
+        Args:
+            client_factory: Função sem argumentos que retorna o cliente da Anthropic
+            scheduler_call: `OutboundScheduler.call` do servidor; com ele o resumo
+                respeita os mesmos limites de RPM/TPM das conversas e as novas
+                tentativas ficam com o agendador
+        """
+        self.client_factory = client_factory
+        self.scheduler_call = scheduler_call
+        self.history_tokens = history_tokens
+        self.max_messages = max_messages
+        self.summary_enabled = summary_enabled
+        self.summary_model = summary_model
+        self.summary_tokens = summary_tokens
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def build(self, chat_id):
+        """Monta o histórico de um chat.
+
+        A linha do chat já traz o resumo e a última resposta do assistente; as
+        mensagens anteriores só são lidas (no máximo `max_messages`) se ainda
+        sobrar orçamento depois dela.
+
+        Returns:
+            (mensagens em ordem cronológica, resumo ou None)
+        """
+        state = get_chat_context(chat_id)
+        summary = state.get('summary') or None
+        summarized_through = int(state.get('summary_through_id') or 0)
+        last_assistant = state.get('last_assistant')
+        if last_assistant and last_assistant['id'] <= summarized_through:
+            last_assistant = None
+
+        # Da mais nova para a mais antiga, enquanto couber no orçamento. A última
+        # resposta sempre entra, como no contexto mínimo de antes.
+        window = []
+        used_tokens = 0
+
+        def add(row):
+            nonlocal used_tokens
+            content = compact_chart_blocks(row['content'])
+            tokens = estimate_tokens(content)
+            if window and used_tokens + tokens > self.history_tokens:
+                return False
+            window.append({"id": row['id'], "role": row['role'], "content": content})
+            used_tokens += tokens
+            return True
+
+        if last_assistant:
+            add(last_assistant)
+        limit = self.max_messages - len(window) if used_tokens < self.history_tokens else 0
+        # Uma linha além do limite mostra se há mensagem não resumida antes da janela
+        rows = get_recent_chat_messages(
+            chat_id,
+            after_id=summarized_through,
+            before_id=last_assistant['id'] if last_assistant else None,
+            limit=limit + 1
+        )
+        fitted = 0
+        for row in rows[:limit]:
+            if not add(row):
+                break
+            fitted += 1
+        overflow = fitted < len(rows)
+
+        if overflow and self.summary_enabled and window:
+            self.schedule_summary(chat_id, summary, summarized_through, window[-1]['id'])
+
+        messages = []
+        for message in reversed(window):
+            # Papéis repetidos (ex.: turno salvo pela metade) são unidos
+            if messages and messages[-1]['role'] == message['role']:
+                messages[-1]['content'] += "\n\n" + message['content']
+            else:
+                messages.append({"role": message['role'], "content": message['content']})
+        logger.info(f"Contexto do chat {chat_id}: {len(messages)} mensagens (~{used_tokens} tokens), "
+                    f"resumo: {'sim' if summary else 'não'}")
+        return messages, summary
+
+    def schedule_summary(self, chat_id, summary, summarized_through, window_start_id):
+        """Incorpora ao resumo, em segundo plano, as mensagens entre o resumo e a janela."""
+        with self._lock:
+            if chat_id in self._in_flight:
+                return
+            self._in_flight.add(chat_id)
+        threading.Thread(
+            target=self._update_summary,
+            args=(chat_id, summary, summarized_through, window_start_id),
+            name='context-summary',
+            daemon=True
+        ).start()
+
+    def _update_summary(self, chat_id, summary, summarized_through, window_start_id):
+        try:
+            # Da mais antiga não resumida até a janela, SUMMARY_BATCH mensagens por chamada
+            for _ in range(SUMMARY_MAX_BATCHES):
+                messages = get_chat_messages_after(chat_id, after_id=summarized_through,
+                                                   before_id=window_start_id, limit=SUMMARY_BATCH)
+                if not messages:
+                    return
+                summary = self.summarize(summary, messages)
+                # Outro worker pode ter avançado o resumo; nesse caso, parar
+                if not summary or not update_chat_summary(chat_id, summary, messages[-1]['id']):
+                    return
+                summarized_through = messages[-1]['id']
+                logger.info(f"Resumo do chat {chat_id} atualizado até a mensagem {summarized_through}")
+                if len(messages) < SUMMARY_BATCH:
+                    return
+        except Exception as e:
+            logger.error(f"Erro ao atualizar resumo do chat {chat_id}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(chat_id)
+
+    def summarize(self, summary, messages):
+        """Resumo novo a partir do resumo anterior e das mensagens que saíram da janela."""
+        transcript = "\n\n".join(
+            f"{'Consultor' if m['role'] == 'user' else 'Assistente'}: "
+            f"{compact_chart_blocks(m['content'])[:SUMMARY_MESSAGE_CHARS]}"
+            for m in messages
+        )
+        content = (f"Resumo atual:\n{summary or '(vazio)'}\n\n"
+                   f"Novos trechos da conversa:\n{transcript}\n\n"
+                   "Escreva o resumo atualizado.")
+        client = self.client_factory()
+        if self.scheduler_call:
+            client = client.with_options(max_retries=0)
+
+        def create():
+            return client.messages.create(
+                model=self.summary_model,
+                max_tokens=self.summary_tokens,
+                temperature=0,
+                system=SUMMARY_SYSTEM_PROMPT,
+                messages=[{"role": "user", "content": content}],
+                timeout=30.0
+            )
+
+        if self.scheduler_call:
+            response = self.scheduler_call(create, estimate_tokens(SUMMARY_SYSTEM_PROMPT + content))
+        else:
+            response = create()
+        return "".join(block.text for block in response.content if getattr(block, 'type', None) == 'text').strip()
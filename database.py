@@ -1,27 +1,219 @@
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import PoolError
 import os
 from dotenv import load_dotenv
 import bcrypt
 from datetime import datetime
 import uuid
 import json
+import base64
+import time
+import threading
+from collections import deque
 
 load_dotenv()
 
-def get_db_connection():
-    try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME'),
+# Configuração do pool (uma instância por worker do Gunicorn)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))  # Máximo de conexões abertas
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))  # Espera máxima por uma conexão livre
+DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', 1800))  # Idade máxima de uma conexão (s)
+DB_POOL_PING_INTERVAL = float(os.getenv('DB_POOL_PING_INTERVAL', 30))  # Ociosidade que exige ping (s)
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 10))
+
+# Tamanho da prévia da última mensagem na listagem de chats
+CHAT_PREVIEW_LENGTH = 120
+
+class PooledConnection:
+    """Conexão emprestada do pool.
+
+    Repassa tudo para a conexão real; `close()` devolve a conexão ao pool em
+    vez de fechá-la, então o código existente (`connection.close()` no
+    `finally`) continua funcionando sem mudanças.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool._release(raw, self._created_at)
+
+class ConnectionPool:
+    """Pool de conexões MySQL limitado, com timeout de espera, ping e reciclagem."""
+
+    def __init__(self, size, timeout, recycle, ping_interval, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self._connect_args = connect_args
+        self._idle = deque()  # (conexão, criada_em, devolvida_em)
+        self._open = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'connects': 0,
+            'recycled': 0,
+            'ping_failures': 0
+        }
+
+    def _incr(self, key):
+        with self._cond:
+            self._stats[key] += 1
+
+    def _connect(self):
+        raw = mysql.connector.connect(
             autocommit=False,  # Desabilitar autocommit para controle manual
-            pool_size=5,  # Pool de conexões
-            pool_name="horizont_pool",
-            pool_reset_session=True
+            connection_timeout=DB_CONNECT_TIMEOUT,
+            **self._connect_args
         )
-        return connection
+        self._incr('connects')
+        return raw, time.time()
+
+    def get_connection(self):
+        started = time.time()
+        deadline = started + self.timeout
+        waited = False
+        entry = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolError(f"Nenhuma conexão livre após {self.timeout}s")
+                waited = True
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            if waited:
+                wait_time = time.time() - started
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += wait_time
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+
+        # Conectar/pingar fora do lock para não travar as outras threads
+        try:
+            if entry is None:
+                raw, created_at = self._connect()
+            else:
+                raw, created_at = self._revalidate(*entry)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        return PooledConnection(self, raw, created_at)
+
+    def _revalidate(self, raw, created_at, released_at):
+        now = time.time()
+        if now - created_at > self.recycle:
+            self._incr('recycled')
+            self._discard(raw)
+            return self._connect()
+        if now - released_at > self.ping_interval:
+            try:
+                raw.ping(reconnect=False)
+            except Error:
+                self._incr('ping_failures')
+                self._discard(raw)
+                return self._connect()
+        return raw, created_at
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _release(self, raw, created_at):
+        healthy = True
+        try:
+            # Encerrar a transação aberta (inclusive de leitura) para que o
+            # próximo uso não enxergue um snapshot antigo
+            if raw.in_transaction:
+                raw.rollback()
+        except Exception:
+            healthy = False
+            self._discard(raw)
+
+        with self._cond:
+            self._in_use -= 1
+            if healthy:
+                self._idle.append((raw, created_at, time.time()))
+            else:
+                self._open -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'wait_time_avg': (stats['wait_time_total'] / stats['waits']) if stats['waits'] else 0.0
+            })
+        return stats
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Retorna o pool do processo, criando-o no primeiro uso (após o fork)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    size=DB_POOL_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    recycle=DB_POOL_RECYCLE,
+                    ping_interval=DB_POOL_PING_INTERVAL,
+                    host=os.getenv('DB_HOST'),
+                    user=os.getenv('DB_USER'),
+                    password=os.getenv('DB_PASSWORD'),
+                    database=os.getenv('DB_NAME')
+                )
+    return _pool
+
+def get_pool_stats():
+    return get_pool().stats()
+
+def get_db_connection():
+    try:
+        return get_pool().get_connection()
+    except PoolError as e:
+        print(f"Pool de conexões esgotado: {e}")
+        return None
     except Error as e:
         print(f"Erro ao conectar ao banco de dados: {e}")
         return None
@@ -136,7 +328,32 @@ def delete_user(username):
         cursor.close()
         connection.close()
 
-def get_user_chats(username):
+# Consultas frequentes: as constantes *_SQL também são verificadas com EXPLAIN
+# por `migrate.py --explain`, então o plano checado é o da consulta real.
+USER_CHATS_SQL = """
+    SELECT c.id, c.title, c.created_at, c.updated_at, c.last_message_at,
+           (SELECT COUNT(*)
+            FROM chat_messages m
+            WHERE m.chat_id = c.id) AS message_count,
+           (SELECT LEFT(lm.content, %s)
+            FROM chat_messages lm
+            WHERE lm.chat_id = c.id
+            ORDER BY lm.created_at DESC, lm.id DESC
+            LIMIT 1) AS last_message_preview
+    FROM chats c
+    JOIN users u ON c.user_id = u.id
+    WHERE u.username = %s
+    ORDER BY COALESCE(c.last_message_at, '1970-01-01') DESC
+"""
+
+def get_user_chats(username, include_messages=False):
+    """Lista os chats do usuário em uma única consulta.
+
+    Cada chat traz `message_count` e `last_message_preview` em vez das
+    mensagens; o histórico completo é carregado sob demanda para o chat aberto.
+    Com `include_messages=True` devolve o formato antigo (chave `messages`),
+    buscando as mensagens de todos os chats em uma segunda consulta.
+    """
     connection = get_db_connection()
     if connection is None:
         return []
@@ -144,27 +361,28 @@ def get_user_chats(username):
     try:
         cursor = connection.cursor(dictionary=True)
         
-        # Primeiro buscar os chats
-        cursor.execute("""
-            SELECT c.id, c.title, c.created_at, c.updated_at, c.last_message_at
-            FROM chats c
-            JOIN users u ON c.user_id = u.id
-            WHERE u.username = %s
-            ORDER BY COALESCE(c.last_message_at, '1970-01-01') DESC
-        """, (username,))
+        cursor.execute(USER_CHATS_SQL, (CHAT_PREVIEW_LENGTH, username))
         
         chats = cursor.fetchall()
         
-        # Para cada chat, buscar suas mensagens
-        for chat in chats:
+        if include_messages and chats:
+            # Uma consulta para todos os chats, agrupada em memória (sem N+1)
             cursor.execute("""
-                SELECT role, content, created_at
-                FROM chat_messages
-                WHERE chat_id = %s
-                ORDER BY created_at ASC
-            """, (chat['id'],))
+                SELECT m.chat_id, m.role, m.content, m.created_at
+                FROM chat_messages m
+                JOIN chats c ON m.chat_id = c.id
+                JOIN users u ON c.user_id = u.id
+                WHERE u.username = %s
+                ORDER BY m.chat_id, m.created_at ASC, m.id ASC
+            """, (username,))
+            
+            messages_by_chat = {}
+            for row in cursor.fetchall():
+                chat_id = row.pop('chat_id')
+                messages_by_chat.setdefault(chat_id, []).append(row)
             
-            chat['messages'] = cursor.fetchall()
+            for chat in chats:
+                chat['messages'] = messages_by_chat.get(chat['id'], [])
         
         return chats
     except Error as e:
@@ -203,60 +421,400 @@ def create_chat(username, title):
         cursor.close()
         connection.close()
 
-def add_message_to_chat(chat_id, role, content):
-    connection = get_db_connection()
-    if connection is None:
-        return False
+# Colunas de uso de tokens em chat_messages (preenchidas nas respostas do assistente)
+USAGE_COLUMNS = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens',
+                 'max_tokens', 'stop_reason')
+
+def add_messages(messages, connection=None):
+    """Grava várias mensagens em uma única transação.
+
+    Args:
+        messages: Lista de dicionários com chat_id, role, content e, opcionalmente,
+            document_id e usage (tokens da resposta, ver token_accounting.usage_dict),
+            na ordem em que devem aparecer no chat
+        connection: Conexão já aberta (ex.: scripts de importação em massa); nesse
+            caso ela não é fechada aqui
+
+    O INSERT vai em um executemany, que o conector transforma em um único INSERT
+    com várias linhas, seguido de um UPDATE por chat envolvido (last_message_at e,
+    se houver resposta do assistente, o ponteiro para a última resposta), da soma
+    dos tokens do dia por usuário e um único commit.
+    """
+    if not messages:
+        return True
+    
+    own_connection = connection is None
+    if own_connection:
+        connection = get_db_connection()
+        if connection is None:
+            return False
     
+    cursor = None
     try:
         cursor = connection.cursor()
+        cursor.executemany("""
+            INSERT INTO chat_messages (chat_id, role, content, document_id, input_tokens, output_tokens,
+                                       cache_creation_input_tokens, cache_read_input_tokens,
+                                       max_tokens, stop_reason)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, [(m['chat_id'], m['role'], m['content'], m.get('document_id'))
+              + tuple((m.get('usage') or {}).get(field) for field in USAGE_COLUMNS)
+              for m in messages])
         
-        # Inserir mensagem e atualizar timestamp em uma única transação
-        cursor.execute("""
-            INSERT INTO chat_messages (chat_id, role, content)
-            VALUES (%s, %s, %s)
-        """, (chat_id, role, content))
+        # Um INSERT simples com várias linhas recebe ids consecutivos a partir
+        # de LAST_INSERT_ID(), na ordem de `messages`
+        first_id = cursor.lastrowid
+        if not first_id:
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            first_id = cursor.fetchone()[0]
         
-        cursor.execute("""
-            UPDATE chats 
-            SET last_message_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, (chat_id,))
+        last_assistant = {}
+        for offset, m in enumerate(messages):
+            if m['role'] == 'assistant':
+                last_assistant[m['chat_id']] = (first_id + offset, m['content'])
+        
+        if last_assistant:
+            cursor.executemany("""
+                UPDATE chats
+                SET last_message_at = CURRENT_TIMESTAMP,
+                    last_assistant_message_id = %s,
+                    last_assistant_content = %s
+                WHERE id = %s
+            """, [(message_id, content, chat_id) for chat_id, (message_id, content) in last_assistant.items()])
+        
+        # Soma diária por usuário (dono do chat), agregada por chat antes de ir
+        # ao banco. Um execute por chat: com INSERT ... SELECT o executemany
+        # tentaria reescrever o comando como INSERT de várias linhas e falharia
+        usage_by_chat = {}
+        for m in messages:
+            if not m.get('usage'):
+                continue
+            totals = usage_by_chat.setdefault(m['chat_id'], [0] * 7)
+            totals[0] += 1
+            for i, field in enumerate(USAGE_COLUMNS[:5], start=1):
+                totals[i] += m['usage'].get(field) or 0
+            totals[6] += int(m['usage'].get('stop_reason') == 'max_tokens')
+        for chat_id, totals in usage_by_chat.items():
+            cursor.execute("""
+                INSERT INTO user_token_usage (user_id, day, requests, input_tokens, output_tokens,
+                                              cache_creation_input_tokens, cache_read_input_tokens,
+                                              max_tokens, truncated)
+                SELECT user_id, CURRENT_DATE, %s, %s, %s, %s, %s, %s, %s
+                FROM chats WHERE id = %s
+                ON DUPLICATE KEY UPDATE
+                    requests = requests + VALUES(requests),
+                    input_tokens = input_tokens + VALUES(input_tokens),
+                    output_tokens = output_tokens + VALUES(output_tokens),
+                    cache_creation_input_tokens = cache_creation_input_tokens + VALUES(cache_creation_input_tokens),
+                    cache_read_input_tokens = cache_read_input_tokens + VALUES(cache_read_input_tokens),
+                    max_tokens = max_tokens + VALUES(max_tokens),
+                    truncated = truncated + VALUES(truncated)
+            """, tuple(totals) + (chat_id,))
+        
+        chat_ids = [chat_id for chat_id in dict.fromkeys(m['chat_id'] for m in messages)
+                    if chat_id not in last_assistant]
+        if chat_ids:
+            placeholders = ', '.join(['%s'] * len(chat_ids))
+            cursor.execute(f"""
+                UPDATE chats 
+                SET last_message_at = CURRENT_TIMESTAMP
+                WHERE id IN ({placeholders})
+            """, chat_ids)
         
         connection.commit()
         return True
         
     except Error as e:
-        if connection:
-            connection.rollback()
-        return False
-    except Exception as e:
-        if connection:
-            connection.rollback()
+        print(f"Erro ao salvar mensagens: {e}")
+        connection.rollback()
         return False
     finally:
         if cursor:
             cursor.close()
-        if connection:
+        if own_connection:
             connection.close()
 
-def get_chat_messages(chat_id):
+def turn_messages(chat_id, user_content, assistant_content, document_id=None, usage=None):
+    """Mensagens de um turno no formato aceito por `add_messages`."""
+    return [
+        {'chat_id': chat_id, 'role': 'user', 'content': user_content, 'document_id': document_id},
+        {'chat_id': chat_id, 'role': 'assistant', 'content': assistant_content, 'usage': usage}
+    ]
+
+def save_chat_turn(chat_id, user_content, assistant_content, document_id=None, usage=None):
+    """Grava a pergunta e a resposta de um turno juntas (uma conexão, um commit)."""
+    return add_messages(turn_messages(chat_id, user_content, assistant_content, document_id, usage))
+
+# Memória da conversa: chats.context guarda o resumo incremental dos turnos que
+# já saíram da janela de contexto, {"summary": "...", "summary_through_id": N}.
+# O valor inicial '[]' (create_chat) equivale a um chat ainda sem resumo.
+# A última resposta do assistente fica na própria linha do chat
+# (last_assistant_message_id/last_assistant_content, atualizados por add_messages).
+def get_chat_context(chat_id):
+    """Resumo e última resposta do assistente do chat, lidos em uma única linha."""
+    connection = get_db_connection()
+    if connection is None:
+        return {}
+    
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT context, last_assistant_message_id, last_assistant_content
+            FROM chats
+            WHERE id = %s
+        """, (chat_id,))
+        row = cursor.fetchone()
+        if not row:
+            return {}
+        context = json.loads(row[0]) if row[0] else {}
+        context = context if isinstance(context, dict) else {}
+        if row[1]:
+            context['last_assistant'] = {'id': row[1], 'role': 'assistant', 'content': row[2] or ''}
+        return context
+    except (Error, ValueError) as e:
+        print(f"Erro ao buscar contexto do chat: {e}")
+        return {}
+    finally:
+        cursor.close()
+        connection.close()
+
+RECENT_CHAT_MESSAGES_SQL = """
+    SELECT id, role, content
+    FROM chat_messages
+    WHERE chat_id = %s AND id > %s AND id < %s
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
+
+CHAT_MESSAGES_AFTER_SQL = """
+    SELECT id, role, content
+    FROM chat_messages
+    WHERE chat_id = %s AND id > %s AND id < %s
+    ORDER BY created_at ASC, id ASC
+    LIMIT %s
+"""
+
+def get_recent_chat_messages(chat_id, after_id=0, before_id=None, limit=20):
+    """Últimas `limit` mensagens com after_id < id < before_id, da mais nova para a mais antiga.
+
+    Lê no máximo `limit` linhas pelo índice (chat_id, created_at, id), qualquer
+    que seja o tamanho do chat.
+    """
     connection = get_db_connection()
     if connection is None:
         return []
     
     try:
         cursor = connection.cursor(dictionary=True)
+        cursor.execute(RECENT_CHAT_MESSAGES_SQL, (chat_id, after_id, before_id or 2 ** 31 - 1, limit))
+        return cursor.fetchall()
+    except Error as e:
+        print(f"Erro ao buscar mensagens recentes: {e}")
+        return []
+    finally:
+        cursor.close()
+        connection.close()
+
+def get_chat_messages_after(chat_id, after_id=0, before_id=None, limit=40):
+    """Primeiras `limit` mensagens com after_id < id < before_id, da mais antiga para a mais nova.
+
+    Usada para incorporar ao resumo, em lotes e em ordem, as mensagens que saíram da janela.
+    """
+    connection = get_db_connection()
+    if connection is None:
+        return []
+    
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(CHAT_MESSAGES_AFTER_SQL, (chat_id, after_id, before_id or 2 ** 31 - 1, limit))
+        return cursor.fetchall()
+    except Error as e:
+        print(f"Erro ao buscar mensagens para o resumo: {e}")
+        return []
+    finally:
+        cursor.close()
+        connection.close()
+
+def update_chat_summary(chat_id, summary, through_id):
+    """Grava o novo resumo só se ele avança sobre o atual (evita sobrescrever
+    um resumo mais novo gravado por outro worker)."""
+    connection = get_db_connection()
+    if connection is None:
+        return False
+    
+    try:
+        cursor = connection.cursor()
+        context = json.dumps({"summary": summary, "summary_through_id": through_id}, ensure_ascii=False)
         cursor.execute("""
-            SELECT role, content, created_at
-            FROM chat_messages
-            WHERE chat_id = %s
-            ORDER BY created_at ASC
-        """, (chat_id,))
+            UPDATE chats
+            SET context = %s
+            WHERE id = %s
+              AND COALESCE(JSON_EXTRACT(context, '$.summary_through_id'), 0) < %s
+        """, (context, chat_id, through_id))
+        connection.commit()
+        return cursor.rowcount > 0
+    except Error as e:
+        print(f"Erro ao salvar resumo do chat: {e}")
+        return False
+    finally:
+        cursor.close()
+        connection.close()
+
+# Paginação por keyset do histórico: o cursor aponta para a mensagem mais antiga
+# já carregada e a próxima página começa logo antes dela, na ordem
+# (created_at, id). O custo de uma página não depende do tamanho do chat.
+MESSAGES_PAGE_DEFAULT = 50
+MESSAGES_PAGE_MAX = 200
+
+def encode_message_cursor(message):
+    raw = f"{message['created_at'].isoformat()}|{message['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_message_cursor(cursor):
+    """Decodifica o cursor; levanta ValueError se ele for inválido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, message_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+# Página do histórico: base + (cursor, se houver) + ordem e LIMIT
+CHAT_MESSAGES_PAGE_SQL = """
+    SELECT m.id, m.role, m.content, m.created_at,
+           m.document_id, d.filename AS document_name
+    FROM chat_messages m
+    JOIN chats c ON m.chat_id = c.id
+    JOIN users u ON c.user_id = u.id
+    LEFT JOIN documents d ON m.document_id = d.id
+    WHERE m.chat_id = %s AND u.username = %s
+"""
+CHAT_MESSAGES_PAGE_BEFORE_SQL = " AND (m.created_at < %s OR (m.created_at = %s AND m.id < %s))"
+CHAT_MESSAGES_PAGE_ORDER_SQL = " ORDER BY m.created_at DESC, m.id DESC LIMIT %s"
+
+def get_chat_messages_page(chat_id, username, before=None, limit=MESSAGES_PAGE_DEFAULT):
+    """Retorna uma página do histórico, da mais antiga para a mais nova.
+
+    Args:
+        chat_id: ID do chat
+        username: Dono do chat (chats de outros usuários retornam vazio)
+        before: Cursor devolvido pela página anterior (None = mais recentes)
+        limit: Tamanho da página (limitado a MESSAGES_PAGE_MAX)
+
+    Returns:
+        dict com `messages`, `has_more` e `next_cursor` (para mensagens mais antigas)
+    """
+    limit = max(1, min(int(limit), MESSAGES_PAGE_MAX))
+    
+    connection = get_db_connection()
+    if connection is None:
+        return {'messages': [], 'has_more': False, 'next_cursor': None}
+    
+    try:
+        cursor = connection.cursor(dictionary=True)
         
-        return cursor.fetchall()
+        query = CHAT_MESSAGES_PAGE_SQL
+        params = [chat_id, username]
+        
+        if before:
+            created_at, message_id = decode_message_cursor(before)
+            query += CHAT_MESSAGES_PAGE_BEFORE_SQL
+            params.extend([created_at, created_at, message_id])
+        
+        # Busca um item a mais só para saber se ainda há páginas
+        query += CHAT_MESSAGES_PAGE_ORDER_SQL
+        params.append(limit + 1)
+        
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        
+        return {
+            'messages': rows,
+            'has_more': has_more,
+            'next_cursor': encode_message_cursor(rows[0]) if has_more else None
+        }
+    except Error as e:
+        print(f"Erro ao buscar página de mensagens: {e}")
+        return {'messages': [], 'has_more': False, 'next_cursor': None}
+    finally:
+        cursor.close()
+        connection.close()
+
+# Documentos (PDFs) guardados uma única vez, identificados pelo SHA-256 do
+# arquivo. Um reenvio do mesmo PDF reaproveita o texto já extraído.
+def get_document(document_id):
+    connection = get_db_connection()
+    if connection is None:
+        return None
+    
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT id, filename, size_bytes, content, created_at
+            FROM documents
+            WHERE id = %s
+        """, (document_id,))
+        return cursor.fetchone()
     except Error as e:
-        print(f"Erro ao buscar mensagens: {e}")
+        print(f"Erro ao buscar documento: {e}")
+        return None
+    finally:
+        cursor.close()
+        connection.close()
+
+def save_document(document_id, filename, size_bytes, content):
+    connection = get_db_connection()
+    if connection is None:
+        return False
+    
+    try:
+        cursor = connection.cursor()
+        # INSERT IGNORE: dois envios simultâneos do mesmo arquivo gravam uma vez só
+        cursor.execute("""
+            INSERT IGNORE INTO documents (id, filename, size_bytes, content)
+            VALUES (%s, %s, %s, %s)
+        """, (document_id, filename, size_bytes, content))
+        connection.commit()
+        return True
+    except Error as e:
+        print(f"Erro ao salvar documento: {e}")
+        return False
+    finally:
+        cursor.close()
+        connection.close()
+
+def get_token_usage_by_user(days=30):
+    """Tokens somados por usuário nos últimos `days` dias."""
+    connection = get_db_connection()
+    if connection is None:
+        return []
+    
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT u.username,
+                   SUM(t.requests) AS requests,
+                   SUM(t.input_tokens) AS input_tokens,
+                   SUM(t.output_tokens) AS output_tokens,
+                   SUM(t.cache_creation_input_tokens) AS cache_creation_input_tokens,
+                   SUM(t.cache_read_input_tokens) AS cache_read_input_tokens,
+                   SUM(t.max_tokens) AS max_tokens,
+                   SUM(t.truncated) AS truncated
+            FROM user_token_usage t
+            JOIN users u ON t.user_id = u.id
+            WHERE t.day >= CURRENT_DATE - INTERVAL %s DAY
+            GROUP BY u.username
+            ORDER BY output_tokens DESC
+        """, (days,))
+        # SUM devolve Decimal; converter para o JSON da API
+        return [{key: int(value) if key != 'username' else value for key, value in row.items()}
+                for row in cursor.fetchall()]
+    except Error as e:
+        print(f"Erro ao buscar uso de tokens: {e}")
         return []
     finally:
         cursor.close()
@@ -279,30 +837,98 @@ def delete_chat(chat_id):
         cursor.close()
         connection.close()
 
-def get_prompt():
+# Cache do prompt ativo em memória. O conteúdo é servido sem ir ao banco;
+# a cada PROMPT_CACHE_TTL segundos uma consulta leve (só o id) confirma que
+# nenhum outro worker publicou um prompt novo.
+PROMPT_CACHE_TTL = float(os.getenv('PROMPT_CACHE_TTL', 60))
+
+_prompt_cache = {
+    'loaded': False,
+    'content': None,
+    'version': None,  # id da linha ativa em prompts
+    'checked_at': 0.0
+}
+_prompt_cache_stats = {'hits': 0, 'version_checks': 0, 'loads': 0, 'invalidations': 0}
+_prompt_cache_lock = threading.Lock()
+
+# `{columns}` é preenchido com nomes fixos de colunas, nunca com dados externos
+ACTIVE_PROMPT_SQL = """
+    SELECT {columns}
+    FROM prompts
+    WHERE is_active = TRUE
+    ORDER BY updated_at DESC
+    LIMIT 1
+"""
+
+def _fetch_active_prompt(columns):
     connection = get_db_connection()
     if connection is None:
-        return None
+        raise Error("Sem conexão com o banco")
     
     try:
         cursor = connection.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT content
-            FROM prompts
-            WHERE is_active = TRUE
-            ORDER BY updated_at DESC
-            LIMIT 1
-        """)
-        
-        result = cursor.fetchone()
-        return result['content'] if result else None
-    except Error as e:
-        print(f"Erro ao buscar prompt: {e}")
-        return None
+        cursor.execute(ACTIVE_PROMPT_SQL.format(columns=columns))
+        return cursor.fetchone()
     finally:
         cursor.close()
         connection.close()
 
+def get_active_prompt():
+    """Retorna (conteúdo, versão) do prompt ativo, usando o cache em memória."""
+    now = time.time()
+    if _prompt_cache['loaded'] and now - _prompt_cache['checked_at'] < PROMPT_CACHE_TTL:
+        _prompt_cache_stats['hits'] += 1
+        return _prompt_cache['content'], _prompt_cache['version']
+
+    with _prompt_cache_lock:
+        # Outra thread pode ter atualizado o cache enquanto esperávamos o lock
+        now = time.time()
+        if _prompt_cache['loaded'] and now - _prompt_cache['checked_at'] < PROMPT_CACHE_TTL:
+            _prompt_cache_stats['hits'] += 1
+            return _prompt_cache['content'], _prompt_cache['version']
+
+        try:
+            if _prompt_cache['loaded']:
+                _prompt_cache_stats['version_checks'] += 1
+                row = _fetch_active_prompt("id")
+                version = row['id'] if row else None
+                if version == _prompt_cache['version']:
+                    _prompt_cache['checked_at'] = now
+                    return _prompt_cache['content'], _prompt_cache['version']
+
+            _prompt_cache_stats['loads'] += 1
+            row = _fetch_active_prompt("id, content")
+            _prompt_cache.update({
+                'loaded': True,
+                'content': row['content'] if row else None,
+                'version': row['id'] if row else None,
+                'checked_at': now
+            })
+        except Error as e:
+            print(f"Erro ao buscar prompt: {e}")
+            # Banco indisponível: continua servindo o prompt que já temos
+            if not _prompt_cache['loaded']:
+                return None, None
+
+        return _prompt_cache['content'], _prompt_cache['version']
+
+def get_prompt():
+    return get_active_prompt()[0]
+
+def invalidate_prompt_cache():
+    with _prompt_cache_lock:
+        _prompt_cache.update({'loaded': False, 'checked_at': 0.0})
+        _prompt_cache_stats['invalidations'] += 1
+
+def get_prompt_cache_stats():
+    stats = dict(_prompt_cache_stats)
+    stats.update({
+        'ttl': PROMPT_CACHE_TTL,
+        'version': _prompt_cache['version'],
+        'age': (time.time() - _prompt_cache['checked_at']) if _prompt_cache['loaded'] else None
+    })
+    return stats
+
 def update_prompt(content, username):
     connection = get_db_connection()
     if connection is None:
@@ -325,9 +951,21 @@ def update_prompt(content, username):
         """, ('Prompt Atualizado', 'Atualização do prompt do sistema', content, username, username))
         
         connection.commit()
+        
+        # Publicar o novo prompt no cache deste worker imediatamente; os demais
+        # percebem a troca na próxima checagem de versão
+        with _prompt_cache_lock:
+            _prompt_cache.update({
+                'loaded': True,
+                'content': content,
+                'version': cursor.lastrowid,
+                'checked_at': time.time()
+            })
+            _prompt_cache_stats['invalidations'] += 1
         return True
     except Error as e:
         print(f"Erro ao atualizar prompt: {e}")
+        invalidate_prompt_cache()
         return False
     finally:
         cursor.close()
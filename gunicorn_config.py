@@ -1,5 +1,6 @@
 import multiprocessing
 import os
+import ssl
 import traceback
 import sys
 import threading
@@ -9,15 +10,20 @@ bind = "0.0.0.0:10000"
 backlog = 1024  # Reduced from 2048
 
 # Worker processes - optimized for 0.5 CPU and 512MB RAM
-workers = 1  # Apenas 1 worker para economizar memória
-worker_class = 'sync'
-threads = 1  # Reduzido para 1 thread
-worker_connections = 100  # Reduzido drasticamente
+# Um único processo com várias threads (gthread): quase todo o tempo de uma
+# requisição é espera de I/O (Claude/MySQL), então as threads atendem várias
+# chamadas lentas em paralelo sem multiplicar o uso de memória.
+workers = int(os.getenv('GUNICORN_WORKERS', 1))  # Apenas 1 worker para economizar memória
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 32))  # Requisições simultâneas por worker
+worker_connections = 100  # Só usado por workers assíncronos (gevent/eventlet)
 
 # Timeouts - optimized for 0.5 CPU and 512MB RAM
+# Com gthread o heartbeat do worker roda na thread principal, então uma chamada
+# longa ao Claude não dispara mais o timeout do worker.
 timeout = 120  # Reduzido para 120s para evitar uso excessivo de memória
 graceful_timeout = 60  # Reduzido para 60s
-keepalive = 1  # Reduzido para 1
+keepalive = 5  # Mantém conexões keep-alive por mais tempo (gthread não bloqueia)
 
 # Logging
 accesslog = '-'
@@ -45,8 +51,10 @@ capture_output = True
 enable_stdio_inheritance = True
 
 # Memory management - optimized for 512MB RAM
-max_requests = 10  # Reduzido drasticamente para liberar memória frequentemente
-max_requests_jitter = 2  # Reduzido para 2
+# Com várias requisições simultâneas por worker, reciclar a cada 10 requisições
+# derrubaria o único worker o tempo todo; o valor é configurável via ambiente.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 500))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 50))
 worker_tmp_dir = "/tmp"
 
 # Prevent workers from hanging
@@ -54,7 +62,7 @@ check_worker_timeout = 60  # Aumentado de 30s para 60s para evitar terminação
 
 # SSL
 ssl_version = 'TLSv1_2'
-cert_reqs = 'CERT_NONE'
+cert_reqs = ssl.CERT_NONE  # gunicorn espera o valor inteiro, não o nome
 ca_certs = None
 suppress_ragged_eofs = True
 do_handshake_on_connect = False
@@ -0,0 +1,78 @@
+"""
+Verificação de dependências em segundo plano para os health checks.
+
+Uma thread roda cada verificação (banco, API do Claude) em um intervalo fixo e
+guarda o resultado com horário; os endpoints de saúde só leem esse resultado,
+sem abrir conexões nem gastar tokens a cada requisição.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class DependencyProber:
+    def __init__(self, checks, interval=30.0):
+        """
+        Args:
+            checks: Dicionário nome -> função sem argumentos que levanta exceção em caso de falha
+            interval: Segundos entre rodadas de verificação
+        """
+        self.checks = checks
+        self.interval = interval
+        self._results = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe_once()
+            self._stop.wait(self.interval)
+
+    def probe_once(self):
+        for name, check in self.checks.items():
+            started = time.perf_counter()
+            error = None
+            try:
+                check()
+            except Exception as e:
+                error = str(e)
+                logger.warning(f"Verificação de saúde '{name}' falhou: {e}")
+
+            result = {
+                'ok': error is None,
+                'latency': round(time.perf_counter() - started, 4),
+                'checked_at': datetime.now().isoformat(),
+                'checked_at_ts': time.time(),
+                'error': error
+            }
+            with self._lock:
+                self._results[name] = result
+
+    def snapshot(self):
+        """Último resultado de cada verificação; `stale` indica resultado antigo demais."""
+        now = time.time()
+        with self._lock:
+            results = {name: dict(result) for name, result in self._results.items()}
+
+        for name in self.checks:
+            if name not in results:
+                results[name] = {'ok': None, 'latency': None, 'checked_at': None, 'error': 'ainda não verificado'}
+                continue
+            # Se a thread parou, o resultado envelhece e deixa de valer
+            checked_at_ts = results[name].pop('checked_at_ts')
+            results[name]['stale'] = now - checked_at_ts > self.interval * 3
+        return results
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Teste de carga simples para o endpoint /api/message
+Dispara N requisições simultâneas para cada nível de concorrência e mostra a
+vazão obtida. Com o worker gthread a vazão deve crescer com N, em vez de ficar
+presa em uma requisição por latência do Claude.
+
+Com --fake-upstream SEGUNDOS o teste não gasta chamadas ao Claude: sobe uma
+API da Anthropic falsa que responde depois de uma espera fixa e inicia o
+servidor (Gunicorn com gunicorn_config.py) apontado para ela via
+ANTHROPIC_BASE_URL. Com latência fixa, a vazão esperada é N / SEGUNDOS.
+
+Uso:
+    python load_test.py --url http://localhost:10000 --levels 1,2,4,8,16
+    python load_test.py --fake-upstream 2 --levels 1,2,4,8,16
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def send_message(url, message, timeout):
+    body = json.dumps({"message": message}).encode('utf-8')
+    req = urllib.request.Request(
+        f"{url}/api/message",
+        data=body,
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    started = time.time()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = None
+    return status, time.time() - started
+
+def run_level(url, concurrency, message, timeout):
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda _: send_message(url, message, timeout),
+            range(concurrency)
+        ))
+    elapsed = time.time() - started
+
+    ok = sum(1 for status, _ in results if status == 200)
+    latencies = sorted(latency for _, latency in results)
+    p50 = latencies[len(latencies) // 2]
+    return {
+        "concurrency": concurrency,
+        "ok": ok,
+        "elapsed": elapsed,
+        "throughput": concurrency / elapsed if elapsed else 0,
+        "p50": p50,
+        "max": latencies[-1]
+    }
+
+def fake_upstream_handler(delay):
+    """Handler da API falsa: /v1/messages responde após `delay` segundos."""
+    class FakeAnthropicHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path.startswith('/v1/messages/count_tokens'):
+                self.reply(200, {"input_tokens": 1000})
+            elif self.path.startswith('/v1/messages') and not body.get('stream'):
+                time.sleep(delay)
+                self.reply(200, {
+                    "id": "msg_load_test",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": body.get('model', 'fake'),
+                    "content": [{"type": "text", "text": "Resposta simulada do teste de carga."}],
+                    "stop_reason": "end_turn",
+                    "stop_sequence": None,
+                    "usage": {"input_tokens": 1000, "output_tokens": 10}
+                })
+            else:
+                self.reply(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+        def reply(self, status, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return FakeAnthropicHandler
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_fake_stack(delay, timeout=60):
+    """Sobe a API falsa e o servidor apontado para ela.
+
+    Returns:
+        (url do servidor, função que encerra tudo)
+    """
+    upstream = ThreadingHTTPServer(('127.0.0.1', 0), fake_upstream_handler(delay))
+    upstream.daemon_threads = True
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        ANTHROPIC_BASE_URL=f"http://127.0.0.1:{upstream.server_address[1]}",
+        ANTHROPIC_API_KEY=os.getenv('ANTHROPIC_API_KEY') or 'sk-ant-load-test',
+        # Sem limites de saída nem sondas: só a concorrência do servidor é medida
+        RATE_LIMIT_ENABLED='false',
+        HEALTH_PROBE_ENABLED='false',
+        RESPONSE_CACHE_ENABLED='false'
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', '--bind', f"127.0.0.1:{port}", 'wsgi:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    def stop():
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        upstream.shutdown()
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health/live", timeout=1):
+                return url, stop
+        except Exception:
+            if server.poll() is not None:
+                break
+            time.sleep(0.5)
+    stop()
+    raise RuntimeError("Servidor não subiu para o teste com API falsa")
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do /api/message")
+    parser.add_argument('--url', default='http://localhost:10000')
+    parser.add_argument('--levels', default='1,2,4,8,16')
+    parser.add_argument('--message', default='Qual a rentabilidade da Horizont Smart?')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--fake-upstream', type=float, metavar='SEGUNDOS',
+                        help="troca o Claude por uma API falsa com espera fixa (sem custo)")
+    args = parser.parse_args()
+
+    stop = None
+    if args.fake_upstream is not None:
+        args.url, stop = start_fake_stack(args.fake_upstream)
+
+    print("=== Teste de Carga - Horizont IA ===")
+    print(f"Iniciado em: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"Alvo: {args.url}/api/message")
+    if stop:
+        print(f"API do Claude falsa: {args.fake_upstream:.2f}s por resposta")
+    print()
+
+    try:
+        for level in [int(n) for n in args.levels.split(',') if n.strip()]:
+            result = run_level(args.url, level, args.message, args.timeout)
+            print(f"N={result['concurrency']:>3} | "
+                  f"ok: {result['ok']}/{result['concurrency']} | "
+                  f"tempo: {result['elapsed']:.2f}s | "
+                  f"vazão: {result['throughput']:.2f} req/s | "
+                  f"p50: {result['p50']:.2f}s | "
+                  f"max: {result['max']:.2f}s")
+    finally:
+        if stop:
+            stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Migrações de esquema versionadas (somente para frente)
+Cada arquivo migrations/NNN_descricao.sql é aplicado uma única vez, em ordem,
+e registrado na tabela schema_migrations. Nenhuma migração apaga dados.
+
+Uso:
+    python migrate.py             # aplica as migrações pendentes
+    python migrate.py --status    # lista migrações aplicadas e pendentes
+    python migrate.py --explain   # falha se uma consulta frequente fizer full scan
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+
+import mysql.connector
+from mysql.connector import Error
+from dotenv import load_dotenv
+
+from database import (
+    ACTIVE_PROMPT_SQL,
+    CHAT_MESSAGES_AFTER_SQL,
+    CHAT_MESSAGES_PAGE_BEFORE_SQL,
+    CHAT_MESSAGES_PAGE_ORDER_SQL,
+    CHAT_MESSAGES_PAGE_SQL,
+    CHAT_PREVIEW_LENGTH,
+    RECENT_CHAT_MESSAGES_SQL,
+    USER_CHATS_SQL
+)
+
+load_dotenv()
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE_RE = re.compile(r'^(\d+)_([\w-]+)\.sql$')
+
+# Consultas frequentes verificadas com EXPLAIN: o SQL vem das constantes de
+# database.py, as mesmas usadas pelas funções. Os parâmetros são apenas exemplos.
+HOT_QUERIES = [
+    ("get_recent_chat_messages", RECENT_CHAT_MESSAGES_SQL,
+     ('00000000-0000-0000-0000-000000000000', 0, 2 ** 31 - 1, 20)),
+    ("get_chat_messages_after", CHAT_MESSAGES_AFTER_SQL,
+     ('00000000-0000-0000-0000-000000000000', 0, 2 ** 31 - 1, 40)),
+    ("get_chat_messages_page", CHAT_MESSAGES_PAGE_SQL + CHAT_MESSAGES_PAGE_ORDER_SQL,
+     ('00000000-0000-0000-0000-000000000000', 'admin', 51)),
+    ("get_chat_messages_page (cursor)",
+     CHAT_MESSAGES_PAGE_SQL + CHAT_MESSAGES_PAGE_BEFORE_SQL + CHAT_MESSAGES_PAGE_ORDER_SQL,
+     ('00000000-0000-0000-0000-000000000000', 'admin',
+      '2025-01-01 00:00:00', '2025-01-01 00:00:00', 2 ** 31 - 1, 51)),
+    ("get_user_chats", USER_CHATS_SQL, (CHAT_PREVIEW_LENGTH, 'admin')),
+    ("get_active_prompt", ACTIVE_PROMPT_SQL.format(columns="id, content"), ()),
+]
+
+def get_connection():
+    return mysql.connector.connect(
+        host=os.getenv('DB_HOST'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME')
+    )
+
+def list_migrations():
+    """Retorna [(versão, nome, caminho)] ordenado pela versão."""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append((match.group(1), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations, key=lambda m: int(m[0]))
+
+def split_statements(sql_script):
+    # Remover comentários de linha antes de dividir nos ';'
+    lines = [line for line in sql_script.splitlines() if not line.strip().startswith('--')]
+    return [command.strip() for command in '\n'.join(lines).split(';') if command.strip()]
+
+def ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(20) PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            checksum CHAR(64) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def get_applied_migrations(cursor):
+    cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cursor.fetchall())
+
+def apply_migrations(connection=None):
+    """Aplica as migrações pendentes e retorna as versões aplicadas.
+
+    DDL no MySQL faz commit implícito, então uma migração que falhe no meio não
+    é registrada; corrija o arquivo e rode de novo.
+    """
+    own_connection = connection is None
+    if own_connection:
+        connection = get_connection()
+
+    applied_now = []
+    cursor = connection.cursor()
+    try:
+        ensure_migrations_table(cursor)
+        applied = get_applied_migrations(cursor)
+
+        for version, name, path in list_migrations():
+            with open(path, 'r', encoding='utf-8') as sql_file:
+                sql_script = sql_file.read()
+            checksum = hashlib.sha256(sql_script.encode('utf-8')).hexdigest()
+
+            if version in applied:
+                if applied[version] != checksum:
+                    print(f"Aviso: migração {version}_{name} foi alterada depois de aplicada")
+                continue
+
+            print(f"Aplicando migração {version}_{name}...")
+            for command in split_statements(sql_script):
+                cursor.execute(command)
+
+            cursor.execute("""
+                INSERT INTO schema_migrations (version, name, checksum)
+                VALUES (%s, %s, %s)
+            """, (version, name, checksum))
+            connection.commit()
+            applied_now.append(version)
+
+        if not applied_now:
+            print("Nenhuma migração pendente.")
+        return applied_now
+    except Error as e:
+        print(f"Erro ao aplicar migrações: {e}")
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        if own_connection:
+            connection.close()
+
+def print_status():
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        ensure_migrations_table(cursor)
+        applied = get_applied_migrations(cursor)
+        for version, name, _ in list_migrations():
+            status = "aplicada" if version in applied else "pendente"
+            print(f"- {version}_{name}: {status}")
+    finally:
+        cursor.close()
+        connection.close()
+
+def check_query_plans(connection=None):
+    """Roda EXPLAIN nas consultas frequentes e retorna as que fazem full scan."""
+    own_connection = connection is None
+    if own_connection:
+        connection = get_connection()
+
+    problems = []
+    cursor = connection.cursor(dictionary=True)
+    try:
+        for name, sql, params in HOT_QUERIES:
+            cursor.execute("EXPLAIN " + sql, params)
+            for row in cursor.fetchall():
+                if row.get('type') == 'ALL':
+                    problems.append(f"{name}: full scan em {row.get('table')} (possible_keys={row.get('possible_keys')})")
+
+        return problems
+    finally:
+        cursor.close()
+        if own_connection:
+            connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrações de esquema do Horizont IA")
+    parser.add_argument('--status', action='store_true', help="lista migrações aplicadas e pendentes")
+    parser.add_argument('--explain', action='store_true', help="verifica os planos das consultas frequentes")
+    args = parser.parse_args()
+
+    if args.status:
+        print_status()
+        return 0
+
+    if args.explain:
+        problems = check_query_plans()
+        for problem in problems:
+            print(f"❌ {problem}")
+        if problems:
+            return 1
+        print("✅ Nenhuma consulta frequente faz full scan")
+        return 0
+
+    apply_migrations()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,8 @@
--- Desabilitar verificação de foreign keys
-SET FOREIGN_KEY_CHECKS = 0;
-
--- Primeiro, dropar todas as tabelas existentes
-DROP TABLE IF EXISTS chat_messages;
-DROP TABLE IF EXISTS chats;
-DROP TABLE IF EXISTS prompts;
-DROP TABLE IF EXISTS users;
-
--- Habilitar verificação de foreign keys novamente
-SET FOREIGN_KEY_CHECKS = 1;
+-- Esquema inicial (equivalente ao antigo setup_database.sql, sem DROP TABLE).
+-- Bancos criados pelo script antigo já têm estas tabelas e não são alterados.
 
 -- Criar tabela de usuários
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     id INT AUTO_INCREMENT PRIMARY KEY,
     username VARCHAR(50) UNIQUE NOT NULL,
     password_hash VARCHAR(255) NOT NULL,
@@ -23,7 +14,7 @@ CREATE TABLE users (
 );
 
 -- Criar tabela de chats
-CREATE TABLE chats (
+CREATE TABLE IF NOT EXISTS chats (
     id VARCHAR(36) PRIMARY KEY,
     user_id INT NOT NULL,
     title VARCHAR(255) NOT NULL,
@@ -35,7 +26,7 @@ CREATE TABLE chats (
 );
 
 -- Criar tabela de mensagens
-CREATE TABLE chat_messages (
+CREATE TABLE IF NOT EXISTS chat_messages (
     id INT AUTO_INCREMENT PRIMARY KEY,
     chat_id VARCHAR(36) NOT NULL,
     role VARCHAR(20) NOT NULL,
@@ -45,7 +36,7 @@ CREATE TABLE chat_messages (
 );
 
 -- Criar tabela de prompts
-CREATE TABLE prompts (
+CREATE TABLE IF NOT EXISTS prompts (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
     description TEXT,
@@ -55,4 +46,4 @@ CREATE TABLE prompts (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     created_by VARCHAR(50) NOT NULL,
     updated_by VARCHAR(50) NOT NULL
-); 
\ No newline at end of file
+);
@@ -0,0 +1,10 @@
+-- Índices compostos para as consultas frequentes de database.py.
+
+-- Histórico do chat e paginação por keyset: WHERE chat_id = ? ORDER BY created_at, id
+CREATE INDEX idx_chat_messages_chat_created ON chat_messages (chat_id, created_at, id);
+
+-- Listagem de chats do usuário: WHERE user_id = ? ORDER BY last_message_at
+CREATE INDEX idx_chats_user_last_message ON chats (user_id, last_message_at);
+
+-- Prompt ativo: WHERE is_active = TRUE ORDER BY updated_at DESC LIMIT 1
+CREATE INDEX idx_prompts_active_updated ON prompts (is_active, updated_at);
@@ -0,0 +1,16 @@
+-- Documentos enviados (PDFs), guardados uma única vez pelo hash do conteúdo.
+
+CREATE TABLE documents (
+    id CHAR(64) PRIMARY KEY,
+    filename VARCHAR(255) NULL,
+    size_bytes INT NOT NULL,
+    content MEDIUMTEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Mensagens passam a referenciar o documento em vez de embutir o texto
+ALTER TABLE chat_messages ADD COLUMN document_id CHAR(64) NULL;
+
+ALTER TABLE chat_messages
+    ADD CONSTRAINT fk_chat_messages_document
+    FOREIGN KEY (document_id) REFERENCES documents(id);
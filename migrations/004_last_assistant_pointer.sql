@@ -0,0 +1,18 @@
+-- Última resposta do assistente guardada na própria linha do chat, para que
+-- montar o contexto de uma pergunta não precise ler o histórico.
+
+ALTER TABLE chats
+    ADD COLUMN last_assistant_message_id INT NULL,
+    ADD COLUMN last_assistant_content TEXT NULL;
+
+-- Preencher os chats existentes
+UPDATE chats c
+JOIN (
+    SELECT chat_id, MAX(id) AS id
+    FROM chat_messages
+    WHERE role = 'assistant'
+    GROUP BY chat_id
+) latest ON latest.chat_id = c.id
+JOIN chat_messages m ON m.id = latest.id
+SET c.last_assistant_message_id = m.id,
+    c.last_assistant_content = m.content;
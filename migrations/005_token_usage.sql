@@ -0,0 +1,25 @@
+-- Uso de tokens de cada resposta do assistente e soma diária por usuário,
+-- para medir respostas cortadas e orçamento de saída não usado.
+
+ALTER TABLE chat_messages
+    ADD COLUMN input_tokens INT NULL,
+    ADD COLUMN output_tokens INT NULL,
+    ADD COLUMN cache_creation_input_tokens INT NULL,
+    ADD COLUMN cache_read_input_tokens INT NULL,
+    ADD COLUMN max_tokens INT NULL,
+    ADD COLUMN stop_reason VARCHAR(20) NULL;
+
+CREATE TABLE IF NOT EXISTS user_token_usage (
+    user_id INT NOT NULL,
+    day DATE NOT NULL,
+    requests INT NOT NULL DEFAULT 0,
+    input_tokens BIGINT NOT NULL DEFAULT 0,
+    output_tokens BIGINT NOT NULL DEFAULT 0,
+    cache_creation_input_tokens BIGINT NOT NULL DEFAULT 0,
+    cache_read_input_tokens BIGINT NOT NULL DEFAULT 0,
+    max_tokens BIGINT NOT NULL DEFAULT 0,
+    truncated INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day),
+    INDEX idx_user_token_usage_day (day),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
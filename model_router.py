@@ -0,0 +1,155 @@
+"""
+Roteamento de modelos: perguntas simples vão para um modelo rápido, as
+complexas para o modelo forte.
+
+O classificador é local (sem chamada extra à API) e usa o tipo do pedido
+(gráfico e PDF vão para o forte), o tamanho da pergunta e palavras-chave de
+análise. Cada rota tem modelo e timeout próprios; o cliente pode forçar uma
+rota por requisição (`modelRoute`) e `MODEL_ROUTE_FORCE` força para todas.
+Latência (p50/p95) e custo estimado ficam por modelo em `stats()`.
+"""
+
+import logging
+import os
+import threading
+import unicodedata
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+MODEL_ROUTING_ENABLED = os.getenv('MODEL_ROUTING_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+MODEL_ROUTE_FORCE = os.getenv('MODEL_ROUTE_FORCE', '').lower() or None  # fast | strong para todas as requisições
+ROUTE_FAST_MAX_CHARS = int(os.getenv('ROUTE_FAST_MAX_CHARS', 300))  # Perguntas maiores vão para o modelo forte
+
+ROUTES = {
+    'fast': {
+        'model': os.getenv('CLAUDE_MODEL_FAST', 'claude-3-haiku-20240307'),
+        'timeout': float(os.getenv('ROUTE_FAST_TIMEOUT', 20))
+    },
+    'strong': {
+        'model': os.getenv('CLAUDE_MODEL_STRONG', 'claude-3-opus-20240229'),
+        'timeout': float(os.getenv('ROUTE_STRONG_TIMEOUT', 45))
+    }
+}
+
+# Radicais (sem acento) que indicam análise, comparação ou planejamento
+ROUTE_STRONG_KEYWORDS = tuple(
+    keyword.strip() for keyword in os.getenv(
+        'ROUTE_STRONG_KEYWORDS',
+        'analis,compar,simul,projec,estrateg,planej,recomend,diversific,aloca,carteira,'
+        'tribut,imposto,explique,por que,porque,vale a pena,melhor opcao,cenario,risco,grafic'
+    ).split(',') if keyword.strip()
+)
+
+# Radicais (sem acento) de pedidos de gráfico/projeção feitos na própria pergunta
+CHART_KEYWORDS = ('grafic', 'projec', 'simul', 'compar')
+
+# Preço em US$ por milhão de tokens (entrada, saída); escrita no cache custa
+# 1,25x a entrada e leitura 0,1x
+MODEL_PRICES = {
+    'claude-3-haiku-20240307': (0.25, 1.25),
+    'claude-3-5-haiku-20241022': (0.80, 4.00),
+    'claude-3-5-sonnet-20241022': (3.00, 15.00),
+    'claude-3-opus-20240229': (15.00, 75.00)
+}
+
+LATENCY_WINDOW = 500  # Latências guardadas por modelo para os percentis
+
+def _normalize(text):
+    normalized = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(ch for ch in normalized if not unicodedata.combining(ch))
+
+def is_chart_request(question):
+    """True se a pergunta pede gráfico ou projeção (sem depender de acentos)."""
+    normalized = _normalize(question)
+    return any(keyword in normalized for keyword in CHART_KEYWORDS)
+
+def choose_route(request_type, question, override=None):
+    """Rota do pedido.
+
+    Args:
+        request_type: Tipo do pedido (chat, chart ou document)
+        question: Texto da pergunta do usuário
+        override: 'fast' ou 'strong' para forçar a rota
+
+    Returns:
+        (rota, motivo)
+    """
+    override = (override or MODEL_ROUTE_FORCE or '').lower()
+    if override in ROUTES:
+        return override, 'forçada'
+    if not MODEL_ROUTING_ENABLED:
+        return 'strong', 'roteamento desligado'
+    if request_type == 'chart':
+        return 'strong', 'gráfico'
+    if request_type == 'document':
+        return 'strong', 'PDF'
+    if len(question) > ROUTE_FAST_MAX_CHARS:
+        return 'strong', 'pergunta longa'
+    normalized = _normalize(question)
+    for keyword in ROUTE_STRONG_KEYWORDS:
+        if keyword in normalized:
+            return 'strong', f"palavra-chave '{keyword}'"
+    return 'fast', 'pergunta simples'
+
+def estimate_cost(model, usage):
+    """Custo estimado em US$ de uma resposta (usage no formato de token_accounting.usage_dict)."""
+    prices = MODEL_PRICES.get(model)
+    if not prices:
+        return 0.0
+    input_price, output_price = prices
+    return (usage['input_tokens'] * input_price
+            + usage['cache_creation_input_tokens'] * input_price * 1.25
+            + usage['cache_read_input_tokens'] * input_price * 0.1
+            + usage['output_tokens'] * output_price) / 1_000_000
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+class ModelRouterStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self._routes = {}
+
+    def record_route(self, route, reason):
+        with self._lock:
+            routes = self._routes.setdefault(route, {})
+            routes[reason] = routes.get(reason, 0) + 1
+
+    def record(self, model, latency, usage=None):
+        """Acumula uma chamada ao modelo; `usage` pode faltar (ex.: erro)."""
+        with self._lock:
+            stats = self._models.setdefault(model, {
+                'requests': 0,
+                'input_tokens': 0,
+                'output_tokens': 0,
+                'cost_usd': 0.0,
+                'latencies': deque(maxlen=LATENCY_WINDOW)
+            })
+            stats['requests'] += 1
+            stats['latencies'].append(latency)
+            if usage:
+                stats['input_tokens'] += usage['input_tokens']
+                stats['output_tokens'] += usage['output_tokens']
+                stats['cost_usd'] += estimate_cost(model, usage)
+
+    def stats(self):
+        with self._lock:
+            models = {}
+            for model, stats in self._models.items():
+                latencies = stats['latencies']
+                models[model] = {
+                    'requests': stats['requests'],
+                    'input_tokens': stats['input_tokens'],
+                    'output_tokens': stats['output_tokens'],
+                    'cost_usd': round(stats['cost_usd'], 4),
+                    'latency_p50': round(_percentile(latencies, 0.5), 3) if latencies else 0.0,
+                    'latency_p95': round(_percentile(latencies, 0.95), 3) if latencies else 0.0
+                }
+            return {
+                'enabled': MODEL_ROUTING_ENABLED,
+                'routes': {route: dict(reasons) for route, reasons in self._routes.items()},
+                'models': models
+            }
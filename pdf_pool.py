@@ -0,0 +1,219 @@
+"""
+Pool de processos para a extração de texto de PDFs.
+
+O parsing do PyPDF2 é pesado em CPU e um PDF grande ou malicioso pode travar
+ou estourar a memória. Cada extração roda em um processo separado, com
+timeout de relógio (o processo é morto e substituído), limite de memória
+(RLIMIT_AS) e reciclagem após um número de tarefas. A espera por um processo
+livre também tem limite, para a requisição não segurar uma thread do Gunicorn
+atrás de vários PDFs lentos.
+"""
+
+import logging
+import multiprocessing
+import os
+import resource
+import threading
+import time
+
+from pdf_utils import PDFExtractionError, extract_text_from_file
+
+logger = logging.getLogger(__name__)
+
+PDF_POOL_SIZE = int(os.getenv('PDF_POOL_SIZE', 1))  # Processos de extração
+PDF_POOL_MAX_QUEUE = int(os.getenv('PDF_POOL_MAX_QUEUE', 8))  # Requisições esperando um processo
+PDF_JOB_TIMEOUT = float(os.getenv('PDF_JOB_TIMEOUT', 30))  # Tempo máximo por PDF (s)
+PDF_POOL_MAX_WAIT = float(os.getenv('PDF_POOL_MAX_WAIT', PDF_JOB_TIMEOUT))  # Espera máxima por um processo livre (s)
+PDF_WORKER_MEMORY_MB = int(os.getenv('PDF_WORKER_MEMORY_MB', 256))  # Memória máxima por processo
+PDF_WORKER_MAX_JOBS = int(os.getenv('PDF_WORKER_MAX_JOBS', 20))  # PDFs antes de reciclar o processo
+
+class PDFPoolBusyError(PDFExtractionError):
+    """Fila de extração cheia ou espera longa demais; a requisição deve ser repetida mais tarde."""
+
+def _worker_main(conn, memory_limit_bytes):
+    """Laço do processo filho: recebe caminhos de PDF e devolve o texto."""
+    if memory_limit_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+
+    while True:
+        try:
+            path = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if path is None:
+            break
+
+        try:
+            conn.send(('ok', extract_text_from_file(path)))
+        except MemoryError:
+            conn.send(('error', "PDF excede o limite de memória para processamento"))
+        except PDFExtractionError as e:
+            conn.send(('error', str(e)))
+        except Exception as e:
+            conn.send(('error', f"Não foi possível ler o PDF: {e}"))
+
+class _Worker:
+    def __init__(self, context, memory_limit_bytes):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, memory_limit_bytes),
+            name='pdf-worker',
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(1)
+        self.conn.close()
+
+class PDFWorkerPool:
+    def __init__(self, size=PDF_POOL_SIZE, max_queue=PDF_POOL_MAX_QUEUE, timeout=PDF_JOB_TIMEOUT,
+                 memory_mb=PDF_WORKER_MEMORY_MB, max_jobs_per_worker=PDF_WORKER_MAX_JOBS,
+                 max_wait=PDF_POOL_MAX_WAIT):
+        self.size = size
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.memory_limit_bytes = memory_mb * 1024 * 1024 if memory_mb else 0
+        self.max_jobs_per_worker = max_jobs_per_worker
+        # spawn: não herda threads/locks do worker do Gunicorn
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = []
+        self._started = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'jobs': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'rejected': 0,
+            'wait_timeouts': 0,
+            'recycled': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+            'wait_time_total': 0.0,
+            'max_queue_depth': 0
+        }
+
+    def _incr(self, key):
+        with self._cond:
+            self._stats[key] += 1
+
+    def _acquire(self):
+        with self._cond:
+            if self._waiting >= self.max_queue:
+                self._stats['rejected'] += 1
+                raise PDFPoolBusyError("Muitos PDFs em processamento. Tente novamente em instantes.")
+
+            self._waiting += 1
+            self._stats['max_queue_depth'] = max(self._stats['max_queue_depth'], self._waiting)
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while not self._idle and self._started >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['rejected'] += 1
+                        self._stats['wait_timeouts'] += 1
+                        raise PDFPoolBusyError("Muitos PDFs em processamento. Tente novamente em instantes.")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    return self._idle.pop()
+                self._started += 1
+            finally:
+                self._waiting -= 1
+
+        try:
+            return _Worker(self._context, self.memory_limit_bytes)
+        except Exception:
+            with self._cond:
+                self._started -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, worker, healthy):
+        recycle = not healthy or worker.jobs >= self.max_jobs_per_worker
+        if recycle:
+            if healthy:
+                worker.stop()
+                self._incr('recycled')
+            else:
+                worker.kill()
+        with self._cond:
+            if recycle:
+                self._started -= 1
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def extract(self, path):
+        """Extrai o texto do PDF em um processo do pool.
+
+        Raises:
+            PDFPoolBusyError: fila cheia ou nenhum processo livre em `max_wait`
+            PDFExtractionError: PDF inválido, timeout ou limite de memória
+        """
+        queued_at = time.perf_counter()
+        worker = self._acquire()
+        started = time.perf_counter()
+        healthy = False
+        try:
+            worker.conn.send(path)
+            if not worker.conn.poll(self.timeout):
+                self._incr('timeouts')
+                logger.warning(f"Extração de PDF passou de {self.timeout}s; processo reiniciado")
+                raise PDFExtractionError("O PDF demorou demais para ser processado")
+
+            status, result = worker.conn.recv()
+            worker.jobs += 1
+            healthy = True
+            if status != 'ok':
+                raise PDFExtractionError(result)
+            return result
+        except (EOFError, OSError):
+            # Processo morreu (ex.: estouro de memória no nível do sistema)
+            self._incr('failures')
+            raise PDFExtractionError("Falha no processamento do PDF")
+        except PDFExtractionError:
+            self._incr('failures')
+            raise
+        finally:
+            latency = time.perf_counter() - started
+            with self._cond:
+                self._stats['jobs'] += 1
+                self._stats['latency_total'] += latency
+                self._stats['latency_max'] = max(self._stats['latency_max'], latency)
+                self._stats['wait_time_total'] += started - queued_at
+            self._release(worker, healthy)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self.size,
+                'workers': self._started,
+                'idle': len(self._idle),
+                'queue_depth': self._waiting,
+                'latency_avg': stats['latency_total'] / stats['jobs'] if stats['jobs'] else 0.0,
+                'wait_time_avg': stats['wait_time_total'] / stats['jobs'] if stats['jobs'] else 0.0
+            })
+        return stats
+
+    def shutdown(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+        for worker in idle:
+            worker.stop()
@@ -0,0 +1,138 @@
+"""
+Extração de texto de PDFs com limites de páginas, bytes e tempo.
+
+O upload é gravado em um arquivo temporário em blocos (sem manter o PDF
+inteiro na memória) e o texto é extraído página a página por um gerador,
+montado com join em vez de concatenação repetida de strings.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import resource
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+PDF_MAX_BYTES = int(os.getenv('PDF_MAX_BYTES', 20 * 1024 * 1024))  # Tamanho máximo do arquivo
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', 100))  # Páginas extraídas no máximo
+PDF_MAX_CHARS = int(os.getenv('PDF_MAX_CHARS', 200000))  # Texto extraído no máximo
+PDF_MAX_SECONDS = float(os.getenv('PDF_MAX_SECONDS', 20))  # Tempo de extração no máximo
+
+CHUNK_SIZE = 64 * 1024
+
+class PDFExtractionError(ValueError):
+    """Erro de PDF com mensagem que pode ser mostrada ao usuário."""
+
+def _new_temp_path():
+    fd, path = tempfile.mkstemp(prefix='horizont-pdf-', suffix='.pdf')
+    os.close(fd)
+    return path
+
+def spool_upload(stream, max_bytes=PDF_MAX_BYTES):
+    """Copia um upload (arquivo multipart) para um arquivo temporário em blocos.
+
+    Returns:
+        (caminho, sha256) do arquivo temporário; quem chama deve removê-lo.
+        O hash identifica o documento no armazenamento deduplicado.
+    """
+    path = _new_temp_path()
+    written = 0
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise PDFExtractionError(f"PDF maior que o limite de {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                out.write(chunk)
+        return path, digest.hexdigest()
+    except Exception:
+        os.unlink(path)
+        raise
+
+def spool_base64(data_url, max_bytes=PDF_MAX_BYTES):
+    """Decodifica um data URL base64 (formato antigo do JSON) para arquivo temporário.
+
+    Returns:
+        (caminho, sha256), como `spool_upload`.
+    """
+    if not data_url or ',' not in data_url:
+        raise PDFExtractionError("Dados do PDF inválidos")
+
+    encoded = data_url.split(',', 1)[1]
+    path = _new_temp_path()
+    written = 0
+    digest = hashlib.sha256()
+    # Blocos múltiplos de 4 caracteres decodificam de forma independente
+    step = CHUNK_SIZE * 4 // 3 // 4 * 4
+    try:
+        with open(path, 'wb') as out:
+            for start in range(0, len(encoded), step):
+                chunk = base64.b64decode(encoded[start:start + step])
+                written += len(chunk)
+                if written > max_bytes:
+                    raise PDFExtractionError(f"PDF maior que o limite de {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                out.write(chunk)
+        return path, digest.hexdigest()
+    except PDFExtractionError:
+        os.unlink(path)
+        raise
+    except Exception as e:
+        os.unlink(path)
+        raise PDFExtractionError(f"Dados do PDF inválidos: {e}")
+
+def iter_pdf_pages(path, max_pages=PDF_MAX_PAGES, max_seconds=PDF_MAX_SECONDS):
+    """Gera o texto de cada página, parando nos limites de páginas e tempo."""
+    import PyPDF2
+
+    deadline = time.monotonic() + max_seconds
+    with open(path, 'rb') as pdf_file:
+        reader = PyPDF2.PdfReader(pdf_file)
+        for index, page in enumerate(reader.pages):
+            if index >= max_pages:
+                logger.info(f"PDF com mais de {max_pages} páginas; restante ignorado")
+                break
+            if time.monotonic() > deadline:
+                logger.info(f"Extração do PDF passou de {max_seconds}s; restante ignorado")
+                break
+            yield page.extract_text() or ""
+
+def extract_text_from_file(path, max_pages=PDF_MAX_PAGES, max_chars=PDF_MAX_CHARS, max_seconds=PDF_MAX_SECONDS):
+    """Extrai o texto do PDF em `path` respeitando os limites configurados."""
+    started = time.perf_counter()
+    parts = []
+    total_chars = 0
+    pages = 0
+    truncated = False
+
+    try:
+        for page_text in iter_pdf_pages(path, max_pages, max_seconds):
+            pages += 1
+            remaining = max_chars - total_chars
+            if len(page_text) >= remaining:
+                parts.append(page_text[:remaining])
+                truncated = True
+                break
+            parts.append(page_text)
+            total_chars += len(page_text) + 1
+    except Exception as e:
+        raise PDFExtractionError(f"Não foi possível ler o PDF: {e}")
+
+    text = "\n".join(parts)
+    if truncated:
+        text += "\n[... conteúdo do PDF truncado]"
+
+    # ru_maxrss é em KB no Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logger.info(f"PDF extraído: {pages} páginas, {len(text)} caracteres, "
+                f"{os.path.getsize(path) // 1024} KB, {time.perf_counter() - started:.2f}s, "
+                f"pico de RSS {peak_rss_mb:.0f} MB")
+    return text
@@ -0,0 +1,223 @@
+"""
+Agendador das chamadas de saída para a API da Anthropic.
+
+Todas as threads do processo passam pelo mesmo agendador antes de chamar o
+Claude. Dois token buckets limitam requisições por minuto e tokens de entrada
+por minuto; quem não cabe no orçamento espera em uma fila FIFO limitada, e a
+fila cheia ou a espera acima de `max_wait` falham na hora com `ClaudeBusyError`
+(a rota responde 503 "ocupado"). Um 429 pausa todas as chamadas pelo
+`retry-after` devolvido pela API; 429/5xx/529 e erros de conexão são repetidos
+com backoff exponencial com jitter, para que as threads não tentem juntas.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Com mais de um worker do Gunicorn o orçamento é dividido entre os processos
+_WORKERS = max(1, int(os.getenv('GUNICORN_WORKERS', 1)))
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ANTHROPIC_RPM = int(os.getenv('ANTHROPIC_RPM', 50)) / _WORKERS  # Requisições por minuto
+ANTHROPIC_TPM = int(os.getenv('ANTHROPIC_TPM', 40000)) / _WORKERS  # Tokens de entrada por minuto
+RATE_LIMIT_MAX_QUEUE = int(os.getenv('RATE_LIMIT_MAX_QUEUE', 16))  # Chamadas esperando no máximo
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', 15))  # Segundos de espera na fila
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', 2))  # Novas tentativas após 429/5xx
+RATE_LIMIT_BACKOFF = float(os.getenv('RATE_LIMIT_BACKOFF', 1))  # Espera base entre tentativas
+RATE_LIMIT_MAX_BACKOFF = float(os.getenv('RATE_LIMIT_MAX_BACKOFF', 20))
+
+RETRYABLE_STATUS = frozenset((429, 500, 502, 503, 504, 529))
+
+WAIT_WINDOW = 500  # Esperas guardadas para os percentis
+
+class ClaudeBusyError(Exception):
+    """Fila de chamadas ao Claude cheia ou espera acima do limite; tentar mais tarde."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount, now):
+        """Segundos até haver `amount` no balde (pedidos maiores que o balde esperam enchê-lo)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        # Pode ficar negativo com pedidos maiores que o balde: os próximos esperam a dívida
+        self.level -= amount
+
+def _retry_after(error):
+    """Segundos do header retry-after de um erro da API, se houver."""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+def _retryable(error):
+    import anthropic
+    if isinstance(error, anthropic.APITimeoutError):
+        return False  # Repetir um timeout de 45s estouraria o tempo da requisição
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+class OutboundScheduler:
+    def __init__(self, rpm=ANTHROPIC_RPM, tpm=ANTHROPIC_TPM, max_queue=RATE_LIMIT_MAX_QUEUE,
+                 max_wait=RATE_LIMIT_MAX_WAIT, max_retries=RATE_LIMIT_MAX_RETRIES,
+                 backoff=RATE_LIMIT_BACKOFF, max_backoff=RATE_LIMIT_MAX_BACKOFF, enabled=RATE_LIMIT_ENABLED):
+        self.enabled = enabled
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._paused_until = 0.0
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._waits = deque(maxlen=WAIT_WINDOW)
+        self._stats = {
+            'calls': 0,
+            'queued': 0,
+            'rejected': 0,
+            'rate_limited': 0,
+            'retries': 0,
+            'skipped': 0,
+            'queue_peak': 0
+        }
+
+    def acquire(self, tokens):
+        """Espera a vez e o orçamento para uma chamada com `tokens` de entrada.
+
+        Raises:
+            ClaudeBusyError: fila cheia ou espera maior que `max_wait`
+        """
+        if not self.enabled:
+            return
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        ticket = object()
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                self._stats['rejected'] += 1
+                raise ClaudeBusyError("Fila de chamadas ao Claude cheia", self.max_wait)
+            self._queue.append(ticket)
+            self._stats['queue_peak'] = max(self._stats['queue_peak'], len(self._queue))
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._queue[0] is ticket:
+                        # Só o primeiro da fila consome, para um pedido grande não ser ultrapassado sempre
+                        wait = max(self._paused_until - now,
+                                   self._requests.time_until(1, now),
+                                   self._tokens.time_until(tokens, now))
+                        if wait <= 0:
+                            self._requests.consume(1)
+                            self._tokens.consume(tokens)
+                            break
+                    if now + (wait or 0) > deadline or now >= deadline:
+                        self._stats['rejected'] += 1
+                        raise ClaudeBusyError("Limite de chamadas ao Claude atingido",
+                                              round(wait or self.max_wait, 1))
+                    self._condition.wait(min(wait, deadline - now) if wait else deadline - now)
+            finally:
+                self._queue.remove(ticket)
+                self._condition.notify_all()
+
+            waited = time.monotonic() - started
+            self._stats['calls'] += 1
+            if waited > 0.001:
+                self._stats['queued'] += 1
+            self._waits.append(waited)
+        if waited > 0.1:
+            logger.info(f"Chamada ao Claude esperou {waited:.2f}s na fila")
+
+    def try_acquire(self, tokens=0):
+        """Consome o orçamento de uma chamada só se ela puder sair agora, sem fila.
+        
+        Para chamadas opcionais, que têm alternativa local (contagem de tokens):
+        com fila, pausa ou balde vazio devolve False em vez de esperar.
+        """
+        if not self.enabled:
+            return True
+        with self._condition:
+            now = time.monotonic()
+            if (self._queue or self._paused_until > now or self._requests.time_until(1, now) > 0
+                    or self._tokens.time_until(tokens, now) > 0):
+                self._stats['skipped'] += 1
+                return False
+            self._requests.consume(1)
+            self._tokens.consume(tokens)
+            return True
+
+    def pause(self, seconds):
+        """Suspende todas as chamadas por `seconds` (429 vale para a organização inteira)."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+    def _backoff(self, attempt):
+        # Jitter "completo": cada thread espera um tempo diferente
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, fn, tokens):
+        """Executa `fn` (a chamada à API) respeitando limites, retry-after e backoff."""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                return fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not _retryable(e):
+                    raise
+                retry_after = _retry_after(e)
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                with self._condition:
+                    self._stats['retries'] += 1
+                    if getattr(e, 'status_code', None) == 429:
+                        self._stats['rate_limited'] += 1
+                logger.warning(f"Chamada ao Claude falhou ({e}); nova tentativa em {delay:.1f}s")
+                if getattr(e, 'status_code', None) == 429 and self.enabled:
+                    # A pausa vale para todas as threads; o jitter evita que voltem juntas
+                    self.pause(delay + random.uniform(0, self.backoff))
+                else:
+                    time.sleep(delay)
+                attempt += 1
+
+    def stats(self):
+        with self._condition:
+            now = time.monotonic()
+            stats = dict(self._stats)
+            waits = sorted(self._waits)
+            stats.update({
+                'enabled': self.enabled,
+                'queue_depth': len(self._queue),
+                'max_queue': self.max_queue,
+                'wait_avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+                'wait_p95': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                'paused_for': round(max(0.0, self._paused_until - now), 1),
+                'requests_available': round(self._requests.level, 1),
+                'tokens_available': round(self._tokens.level)
+            })
+        return stats
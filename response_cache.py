@@ -0,0 +1,124 @@
+"""
+Cache de respostas do Claude para perguntas repetidas.
+
+A chave é o hash de tudo que determina a resposta: modelo, prompt do sistema
+(o conteúdo identifica a versão, então atualizar o prompt invalida as
+entradas), mensagens de contexto, texto do usuário, temperatura e max_tokens.
+O texto das mensagens é normalizado (espaços e maiúsculas) antes do hash.
+As entradas saem por LRU, por TTL e pelo limite total de bytes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 3600))  # Segundos de validade
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 500))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+# Só respostas pedidas com temperatura até este valor são guardadas
+# (0.1 restringe ao modo de gráficos)
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv('RESPONSE_CACHE_MAX_TEMPERATURE', 1.0))
+
+def _normalize(text):
+    return ' '.join(text.split()).casefold()
+
+def _content_text(content):
+    # system/content podem ser string ou lista de blocos (prompt caching)
+    if isinstance(content, str):
+        return content
+    return ''.join(block.get('text', '') for block in content if isinstance(block, dict))
+
+def make_key(request_kwargs):
+    """Hash normalizado dos parâmetros que determinam a resposta."""
+    payload = {
+        'model': request_kwargs.get('model'),
+        'system': hashlib.sha256(_content_text(request_kwargs.get('system') or '').encode('utf-8')).hexdigest(),
+        'messages': [(m['role'], _normalize(_content_text(m['content']))) for m in request_kwargs.get('messages', [])],
+        'temperature': request_kwargs.get('temperature'),
+        'max_tokens': request_kwargs.get('max_tokens')
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 max_bytes=RESPONSE_CACHE_MAX_BYTES, max_temperature=RESPONSE_CACHE_MAX_TEMPERATURE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_temperature = max_temperature
+        self._entries = OrderedDict()  # chave -> (texto, tamanho, expira_em)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'bypassed': 0,
+            'evictions': 0,
+            'expired': 0
+        }
+
+    def cacheable(self, request_kwargs):
+        return (request_kwargs.get('temperature') or 0) <= self.max_temperature
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats['bypassed'] += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            text, _, expires_at = entry
+            if time.time() >= expires_at:
+                self._remove(key)
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return text
+
+    def set(self, key, text):
+        size = len(text.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (text, size, time.time() + self.ttl)
+            self._bytes += size
+            self._stats['stores'] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats['hits'] + stats['misses']
+            stats.update({
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hit_rate': stats['hits'] / lookups if lookups else 0.0
+            })
+        return stats
@@ -0,0 +1,161 @@
+"""
+Recuperação de trechos relevantes de PDFs (BM25, Python puro).
+
+Em vez de mandar o texto inteiro do PDF ao Claude, o texto é dividido em
+trechos com sobreposição, indexado com BM25 e só os trechos mais relevantes
+para a pergunta entram no turno, dentro de um orçamento de tokens. O índice
+de cada documento fica em memória, identificado pelo hash do arquivo.
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+PDF_RETRIEVAL_ENABLED = os.getenv('PDF_RETRIEVAL_ENABLED', '1').lower() in ('1', 'true', 'yes')
+PDF_CHUNK_CHARS = int(os.getenv('PDF_CHUNK_CHARS', 1500))  # Tamanho de cada trecho
+PDF_CHUNK_OVERLAP = int(os.getenv('PDF_CHUNK_OVERLAP', 200))  # Sobreposição entre trechos
+PDF_TOP_K = int(os.getenv('PDF_TOP_K', 6))  # Trechos enviados no máximo
+PDF_CONTEXT_TOKENS = int(os.getenv('PDF_CONTEXT_TOKENS', 4000))  # Orçamento de tokens do PDF
+PDF_INDEX_CACHE_SIZE = int(os.getenv('PDF_INDEX_CACHE_SIZE', 32))  # Índices mantidos em memória
+
+# Estimativa grosseira usada no orçamento (o Claude fica em ~3-4 caracteres por token em português)
+CHARS_PER_TOKEN = 4
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de do da dos das em no na nos nas por pelo pela pelos pelas
+para com sem sob sobre entre e ou mas que se como mais menos muito pouco ao aos
+ja nao sim eu voce ele ela eles elas nos isso isto esse essa este esta aquele aquela
+seu sua seus suas meu minha qual quais quando onde ser estar ter foi sao esta tem
+the of and to in is for on with
+""".split())
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def tokenize(text):
+    """Minúsculas, sem acentos, sem stopwords e sem termos de uma letra."""
+    normalized = unicodedata.normalize('NFKD', text.lower())
+    normalized = ''.join(ch for ch in normalized if not unicodedata.combining(ch))
+    return [term for term in TOKEN_RE.findall(normalized)
+            if len(term) > 1 and term not in STOPWORDS]
+
+def chunk_text(text, chunk_chars=PDF_CHUNK_CHARS, overlap=PDF_CHUNK_OVERLAP):
+    """Divide o texto em trechos de até `chunk_chars`, cortando em espaços."""
+    text = text.strip()
+    if not text:
+        return []
+    if len(text) <= chunk_chars:
+        return [text]
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            # Cortar no último espaço para não partir palavras
+            cut = text.rfind(' ', start + chunk_chars // 2, end)
+            if cut > start:
+                end = cut
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk]
+
+class BM25Index:
+    def __init__(self, chunks, k1=BM25_K1, b=BM25_B):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(tokenize(chunk)) for chunk in chunks]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+        doc_freq = Counter()
+        for tf in self.term_freqs:
+            doc_freq.update(tf.keys())
+        n = len(chunks)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def scores(self, query):
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        scores = [0.0] * len(self.chunks)
+        if not terms or not self.avg_length:
+            return scores
+        for i, tf in enumerate(self.term_freqs):
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.avg_length)
+            score = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            scores[i] = score
+        return scores
+
+    def search(self, query, top_k):
+        """Índices dos `top_k` trechos mais relevantes (score > 0), do melhor ao pior."""
+        scores = self.scores(query)
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        return [i for i in ranked[:top_k] if scores[i] > 0]
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+def get_index(document_id, text):
+    """Índice BM25 do documento, reaproveitado enquanto estiver no cache LRU."""
+    with _index_cache_lock:
+        index = _index_cache.get(document_id) if document_id else None
+        if index is not None:
+            _index_cache.move_to_end(document_id)
+            return index
+
+    index = BM25Index(chunk_text(text))
+    if document_id:
+        with _index_cache_lock:
+            _index_cache[document_id] = index
+            while len(_index_cache) > PDF_INDEX_CACHE_SIZE:
+                _index_cache.popitem(last=False)
+    return index
+
+def select_context(text, query, document_id=None, top_k=PDF_TOP_K, max_tokens=PDF_CONTEXT_TOKENS):
+    """Monta o trecho do PDF que vai para o Claude.
+
+    Documentos que cabem no orçamento vão inteiros. Nos demais, entram os
+    `top_k` trechos mais relevantes para `query` que couberem em `max_tokens`,
+    na ordem em que aparecem no documento. Se a pergunta não tem termos em
+    comum com o PDF (ex.: "analise o PDF"), usa o início do documento.
+    """
+    if not PDF_RETRIEVAL_ENABLED or estimate_tokens(text) <= max_tokens:
+        return text
+
+    started = time.perf_counter()
+    index = get_index(document_id, text)
+    selected = index.search(query, top_k)
+    if not selected:
+        selected = list(range(min(top_k, len(index.chunks))))
+
+    chosen = []
+    used_tokens = 0
+    for i in selected:
+        chunk_tokens = estimate_tokens(index.chunks[i])
+        if chosen and used_tokens + chunk_tokens > max_tokens:
+            continue
+        chosen.append(i)
+        used_tokens += chunk_tokens
+
+    context = "\n\n".join(f"[Trecho {i + 1}/{len(index.chunks)}]\n{index.chunks[i]}" for i in sorted(chosen))
+    logger.info(f"Recuperação no PDF: {len(chosen)} de {len(index.chunks)} trechos, "
+                f"~{used_tokens} de ~{estimate_tokens(text)} tokens, {time.perf_counter() - started:.3f}s")
+    return context
@@ -1,34 +1,84 @@
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-import anthropic
+import time
+
+# Instrumentação da inicialização: o worker é recriado pelo Gunicorn, então o
+# custo de importar este módulo é pago a cada reciclagem
+_BOOT_STARTED = time.perf_counter()
+BOOT_TIMINGS = {}
+
+from contextlib import ExitStack, contextmanager
+
+@contextmanager
+def boot_step(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        # Só a primeira medição interessa (imports seguintes vêm do cache)
+        BOOT_TIMINGS.setdefault(name, round(time.perf_counter() - started, 4))
+
+with boot_step('import_flask'):
+    from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
+    from flask_cors import CORS
+    from werkzeug.exceptions import RequestEntityTooLarge
 import json
 import os
 from datetime import datetime
 import re
-import PyPDF2
-import base64
-from io import BytesIO
 from dotenv import load_dotenv
 import logging
-from database import (
-    verify_user,
-    get_all_users,
-    create_user,
-    delete_user,
-    get_user_chats,
-    create_chat,
-    add_message_to_chat,
-    get_chat_messages,
-    delete_chat,
-    get_prompt,
-    update_prompt,
-    get_db_connection
+with boot_step('import_database'):
+    from database import (
+        verify_user,
+        get_all_users,
+        create_user,
+        delete_user,
+        get_user_chats,
+        create_chat,
+        add_messages,
+        save_chat_turn,
+        turn_messages,
+        get_chat_messages_page,
+        MESSAGES_PAGE_DEFAULT,
+        delete_chat,
+        get_prompt,
+        get_active_prompt,
+        update_prompt,
+        get_db_connection,
+        get_document,
+        save_document,
+        get_pool_stats,
+        get_prompt_cache_stats,
+        get_token_usage_by_user
+    )
+with boot_step('import_chart_helper'):
+    from chart_helper import (
+        CHART_TOOLS,
+        DEFAULT_PRODUCTS,
+        ChartStreamParser,
+        build_projections,
+        compact_chart_blocks,
+        extract_charts,
+        run_chart_tool
+    )
+from conversation import ConversationMemory
+from health import DependencyProber
+from response_cache import RESPONSE_CACHE_ENABLED, ResponseCache, make_key as make_response_cache_key
+from model_router import ROUTES, ModelRouterStats, choose_route, is_chart_request
+from rate_limiter import ClaudeBusyError, OutboundScheduler
+from retrieval import select_context
+from token_accounting import MAX_OUTPUT_TOKENS, TokenAccounting, choose_max_tokens, count_input_tokens, usage_dict
+from write_behind import WRITE_BEHIND_ENABLED, WriteBehindJournal
+from pdf_pool import PDFWorkerPool, PDFPoolBusyError
+from pdf_utils import (
+    PDF_MAX_BYTES,
+    PDFExtractionError,
+    extract_text_from_file,
+    spool_base64,
+    spool_upload
 )
-from setup_db import setup_database
-import time
 import uuid
 import gc  # Adicionar garbage collector
-import mysql.connector
+import threading
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -43,177 +93,548 @@ logger = logging.getLogger(__name__)
 logger.info("Variáveis de ambiente carregadas")
 
 app = Flask(__name__, static_folder='.', static_url_path='')
+# Limita o corpo da requisição (PDF + campos do formulário)
+app.config['MAX_CONTENT_LENGTH'] = PDF_MAX_BYTES * 2
 CORS(app)
 
-# Cliente Anthropic com timeout reduzido
-api_key = os.getenv('ANTHROPIC_API_KEY')
-logger.info("Verificando variáveis de ambiente:")
-logger.info(f"ANTHROPIC_API_KEY está definida? {'Sim' if api_key else 'Não'}")
-
-if not api_key:
-    logger.error("API key não encontrada nas variáveis de ambiente")
-    raise ValueError("ANTHROPIC_API_KEY não está definida")
-
-if not api_key.startswith('sk-ant-'):
-    logger.error("API key inválida: deve começar com 'sk-ant-'")
-    raise ValueError("ANTHROPIC_API_KEY inválida")
-
-# Add more detailed API key validation
-api_key_length = len(api_key)
-logger.info(f"Comprimento da API key: {api_key_length} caracteres")
-logger.info(f"API key começa com: {api_key[:7]} e termina com: {api_key[-4:]}")
-
-# Check for common issues
-if ' ' in api_key:
-    logger.warning("API key contém espaços em branco")
-if '\n' in api_key or '\r' in api_key:
-    logger.warning("API key contém caracteres de nova linha")
-if len(api_key.strip()) != api_key_length:
-    logger.warning("API key contém espaços em branco no início ou fim")
-
-# Initialize client with clean API key and timeout
-clean_api_key = api_key.strip()
-logger.info("Inicializando cliente do Claude...")
-try:
-    client = anthropic.Anthropic(
-        api_key=clean_api_key,
-        max_retries=2,  # Reduzir número de retries
-        timeout=90.0    # Aumentado de 30s para 90s para evitar timeouts
-    )
-    # Test the client with a simple request
-    test_response = client.messages.create(
-        model="claude-3-opus-20240229",
-        max_tokens=10,
-        messages=[{"role": "user", "content": "Hi"}]
-    )
-    logger.info("Cliente do Claude testado e funcionando!")
-except anthropic.AuthenticationError as e:
-    logger.error(f"Erro de autenticação ao inicializar cliente do Claude: {e}")
-    raise ValueError("Falha na autenticação com a API do Claude. Verifique sua API key.")
-except Exception as e:
-    logger.error(f"Erro ao inicializar cliente do Claude: {e}")
-    raise ValueError(f"Falha ao inicializar cliente do Claude: {e}")
-
-# Configurar banco de dados na inicialização
-logger.info("Configurando banco de dados...")
-try:
-    setup_database()
-    logger.info("Banco de dados configurado com sucesso!")
-except Exception as e:
-    logger.error(f"Erro ao configurar banco de dados: {e}")
-
-def extract_pdf_text(file_data):
-    try:
-        if not file_data or ',' not in file_data:
-            logger.error("Dados do PDF inválidos")
-            return None
-        pdf_bytes = base64.b64decode(file_data.split(',')[1])
+# Cliente Anthropic criado sob demanda (ou pelo aquecimento em segundo plano).
+# Importar este módulo não faz nenhuma chamada à API nem ao banco; o esquema
+# do banco é aplicado à parte com `python setup_db.py`.
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is not None:
+        return _client
+    
+    with _client_lock:
+        if _client is not None:
+            return _client
+        
+        api_key = os.getenv('ANTHROPIC_API_KEY')
+        logger.info(f"ANTHROPIC_API_KEY está definida? {'Sim' if api_key else 'Não'}")
         
-        pdf_file = BytesIO(pdf_bytes)
-        reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
+        if not api_key:
+            logger.error("API key não encontrada nas variáveis de ambiente")
+            raise ValueError("ANTHROPIC_API_KEY não está definida")
         
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
+        if not api_key.startswith('sk-ant-'):
+            logger.error("API key inválida: deve começar com 'sk-ant-'")
+            raise ValueError("ANTHROPIC_API_KEY inválida")
         
-        return text
+        # Check for common issues
+        if ' ' in api_key.strip():
+            logger.warning("API key contém espaços em branco")
+        if '\n' in api_key or '\r' in api_key:
+            logger.warning("API key contém caracteres de nova linha")
+        if len(api_key.strip()) != len(api_key):
+            logger.warning("API key contém espaços em branco no início ou fim")
+        
+        # O SDK é o import mais pesado do servidor; só é carregado aqui
+        with boot_step('import_anthropic'):
+            import anthropic
+        
+        logger.info("Inicializando cliente do Claude...")
+        _client = anthropic.Anthropic(
+            api_key=api_key.strip(),
+            max_retries=2,  # Reduzir número de retries
+            timeout=90.0    # Aumentado de 30s para 90s para evitar timeouts
+        )
+        return _client
+
+def warmup():
+    """Prepara o cliente do Claude e uma conexão do pool sem gastar tokens."""
+    started = time.perf_counter()
+    try:
+        get_client()
+        connection = get_db_connection()
+        if connection is not None:
+            connection.close()
+        BOOT_TIMINGS['warmup'] = round(time.perf_counter() - started, 4)
+        logger.info(f"Aquecimento concluído em {BOOT_TIMINGS['warmup']:.2f}s")
     except Exception as e:
-        logger.error(f"Erro ao extrair texto do PDF: {e}")
+        logger.error(f"Erro no aquecimento: {e}")
+
+# Extração de PDF isolada em processos (timeout, limite de memória, reciclagem)
+PDF_POOL_ENABLED = os.getenv('PDF_POOL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+pdf_pool = PDFWorkerPool()
+
+def extract_pdf_text(pdf_path):
+    """Extrai o texto de um PDF já gravado em disco (ver pdf_utils/pdf_pool)."""
+    if PDF_POOL_ENABLED:
+        return pdf_pool.extract(pdf_path)
+    return extract_text_from_file(pdf_path)
+
+def read_message_payload():
+    """Lê o corpo de /api/message, em JSON ou multipart/form-data.
+
+    No multipart o PDF vem no campo `pdf` e é gravado em arquivo temporário
+    em blocos; no JSON o campo antigo `pdfData` (data URL base64) continua
+    aceito. Returns (data, pdf), onde pdf é None ou um dicionário com `path`,
+    `sha256` e `filename`; quem chama remove o arquivo em `path`.
+    """
+    if request.mimetype == 'multipart/form-data':
+        data = request.form.to_dict()
+        for flag in ('promptCache', 'noCache'):
+            if flag in data:
+                data[flag] = data[flag].lower() in ('1', 'true', 'yes')
+        upload = request.files.get('pdf')
+        if not upload or not upload.filename:
+            return data, None
+        path, sha256 = spool_upload(upload.stream)
+        return data, {"path": path, "sha256": sha256, "filename": upload.filename[:255]}
+    
+    data = request.get_json(silent=True)
+    pdf_data = data.pop('pdfData', None) if isinstance(data, dict) else None
+    if not pdf_data:
+        return data, None
+    path, sha256 = spool_base64(pdf_data)
+    filename = data.get('pdfName')
+    return data, {"path": path, "sha256": sha256, "filename": filename[:255] if filename else None}
+
+# Prompt caching da Anthropic: o prompt do sistema (vários KB de regras) vira um
+# prefixo em cache e não é reprocessado a cada mensagem. Como o cache é chaveado
+# pelo conteúdo, editar o prompt gera automaticamente um prefixo novo.
+PROMPT_CACHE_ENABLED = os.getenv('CLAUDE_PROMPT_CACHE', 'true').lower() in ('1', 'true', 'yes')
+
+# Gráficos via tool use: o Claude chama uma ferramenta com poucos parâmetros e
+# o servidor monta o bloco [GRAFICO_DADOS] (chart_helper), em vez de o modelo
+# escrever o JSON inteiro token a token
+CHART_TOOLS_ENABLED = os.getenv('CLAUDE_CHART_TOOLS', 'true').lower() in ('1', 'true', 'yes')
+CHART_TOOLS_INSTRUCTION = (
+    "\n\nPara gráficos, use as ferramentas grafico_comparativo e grafico_produto "
+    "em vez de escrever o bloco [GRAFICO_DADOS]; o gráfico é anexado automaticamente "
+    "ao final da sua resposta."
+)
+
+# Cache de respostas (opt-in com RESPONSE_CACHE_ENABLED): perguntas repetidas
+# com o mesmo prompt, modelo e contexto voltam da memória sem chamar o Claude
+response_cache = ResponseCache()
+
+def use_response_cache(data):
+    """False se o cache está desligado ou se o cliente pediu para ignorá-lo
+    (`noCache: true` no corpo ou header `Cache-Control: no-cache`)."""
+    if not RESPONSE_CACHE_ENABLED:
+        return False
+    if data.get('noCache') or 'no-cache' in request.headers.get('Cache-Control', ''):
+        response_cache.record_bypass()
+        return False
+    return True
+
+def response_cache_key(request_kwargs, use_cache):
+    """Chave do cache de respostas, ou None se o pedido não deve ser cacheado."""
+    if not use_cache or not response_cache.cacheable(request_kwargs):
         return None
+    return make_response_cache_key(request_kwargs)
+
+# Uso de tokens e latência acumulados, separados por cache ligado/desligado
+# para comparar custo e tempo de resposta entre os dois modos
+_usage_stats = {}
+_usage_lock = threading.Lock()
 
-def parse_chart_from_response(text):
-    """Parse chart data from Claude's response text.
+def record_claude_usage(usage, latency, prompt_cache):
+    mode = 'cache_on' if prompt_cache else 'cache_off'
+    input_tokens = getattr(usage, 'input_tokens', 0) or 0
+    output_tokens = getattr(usage, 'output_tokens', 0) or 0
+    cache_write = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+    cache_read = getattr(usage, 'cache_read_input_tokens', 0) or 0
     
-    Args:
-        text (str): The text to parse
-        
+    with _usage_lock:
+        stats = _usage_stats.setdefault(mode, {
+            'requests': 0,
+            'latency_total': 0.0,
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'cache_creation_input_tokens': 0,
+            'cache_read_input_tokens': 0,
+            'cache_hits': 0
+        })
+        stats['requests'] += 1
+        stats['latency_total'] += latency
+        stats['input_tokens'] += input_tokens
+        stats['output_tokens'] += output_tokens
+        stats['cache_creation_input_tokens'] += cache_write
+        stats['cache_read_input_tokens'] += cache_read
+        if cache_read:
+            stats['cache_hits'] += 1
+    
+    logger.info(f"Uso do Claude ({mode}): entrada={input_tokens}, saída={output_tokens}, "
+                f"cache_escrita={cache_write}, cache_leitura={cache_read}, latência={latency:.2f}s")
+
+# Tokens por tipo de pedido: respostas cortadas e orçamento de saída não usado
+token_accounting = TokenAccounting()
+
+# Latência e custo por modelo, e quantos pedidos cada rota recebeu (e por quê)
+model_router_stats = ModelRouterStats()
+
+# Fila de saída para a API: limites de RPM/TPM compartilhados pelas threads
+claude_scheduler = OutboundScheduler()
+
+CLAUDE_BUSY_MESSAGE = "O assistente está recebendo muitas perguntas agora. Tente novamente em alguns segundos."
+
+def get_usage_stats():
+    with _usage_lock:
+        result = {}
+        for mode, stats in _usage_stats.items():
+            result[mode] = dict(stats)
+            result[mode]['latency_avg'] = stats['latency_total'] / stats['requests'] if stats['requests'] else 0.0
+        return result
+
+def classify_request(messages):
+    """Tipo do pedido (chat, chart ou document), que define o teto de max_tokens."""
+    # Pedido de gráfico: só a última resposta e a nova pergunta contam, não o histórico todo
+    if any("[GRAFICO_DADOS]" in msg["content"] for msg in messages[-2:]):
+        return 'chart'
+    if messages and "Conteúdo do PDF:" in messages[-1]["content"]:
+        return 'document'
+    # Primeiro pedido de gráfico do chat: ainda não há bloco no histórico
+    if messages and is_chart_request(messages[-1]["content"]):
+        return 'chart'
+    return 'chat'
+
+def build_claude_request(messages, prompt_cache=None, summary=None, route=None):
+    """Monta os parâmetros de uma chamada ao Claude.
+
+    Usado tanto pela chamada completa (`process_claude_message`) quanto pelo
+    endpoint de streaming, para que ambos enviem exatamente o mesmo pedido.
+    `prompt_cache` liga/desliga o prompt caching; None usa CLAUDE_PROMPT_CACHE.
+    `summary` é o resumo dos turnos antigos do chat, enviado depois do prompt
+    do sistema (fora do prefixo em cache). `route` (fast | strong) força a rota
+    de modelo; None deixa o `model_router` decidir.
+    """
+    if prompt_cache is None:
+        prompt_cache = PROMPT_CACHE_ENABLED
+    
+    # Obter o prompt do sistema
+    system_prompt, prompt_version = get_active_prompt()
+    logger.info(f"Prompt carregado: {system_prompt[:100] if system_prompt else 'NENHUM PROMPT ENCONTRADO'}...")
+    logger.info(f"Tamanho total do prompt: {len(system_prompt) if system_prompt else 0} caracteres")
+    
+    if not system_prompt:
+        logger.warning("Nenhum prompt do sistema encontrado, usando prompt padrão")
+        system_prompt = "Você é um assistente especializado em investimentos da Horizont Investimentos."
+    
+    # Teto de max_tokens do tipo de pedido; `apply_token_budget` o ajusta à
+    # entrada contada antes da chamada
+    request_type = classify_request(messages)
+    max_tokens = MAX_OUTPUT_TOKENS[request_type]
+    
+    # Modelo rápido para perguntas simples, forte para gráficos, PDFs e análises
+    route, reason = choose_route(request_type, messages[-1]["content"] if messages else "", route)
+    model_router_stats.record_route(route, reason)
+    model = ROUTES[route]["model"]
+    timeout = ROUTES[route]["timeout"]
+    logger.info(f"Rota {route} ({reason}): {model}")
+    
+    # Ajustar temperatura com base no tipo de resposta
+    temp = 0.7
+    
+    if request_type == 'chart':
+        temp = 0.1  # Menor temperatura para respostas estruturadas
+        logger.info(f"Detectado pedido de gráfico - usando timeout de {timeout}s e {max_tokens} tokens")
+    
+    if CHART_TOOLS_ENABLED:
+        system_prompt += CHART_TOOLS_INSTRUCTION
+    
+    logger.info(f"Enviando para Claude com system prompt: {len(system_prompt)} caracteres (versão {prompt_version})")
+    logger.info(f"Configuração: max_tokens={max_tokens}, temperature={temp}, timeout={timeout}s, prompt_cache={prompt_cache}")
+    
+    summary_text = f"Resumo da conversa até aqui:\n{summary}" if summary else None
+    if prompt_cache:
+        system = [{
+            "type": "text",
+            "text": system_prompt,
+            "cache_control": {"type": "ephemeral"}
+        }]
+        if summary_text:
+            system.append({"type": "text", "text": summary_text})
+    else:
+        system = f"{system_prompt}\n\n{summary_text}" if summary_text else system_prompt
+    
+    request_kwargs = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "messages": messages,
+        "system": system,
+        "temperature": temp,
+        "timeout": timeout
+    }
+    if CHART_TOOLS_ENABLED:
+        request_kwargs["tools"] = CHART_TOOLS
+    return request_kwargs
+
+def apply_token_budget(request_kwargs, request_type):
+    """Conta os tokens de entrada e ajusta max_tokens ao tipo e à janela restante.
+
+    Returns:
+        (tokens contados, exato)
+    """
+    input_tokens, exact = count_input_tokens(get_client(), request_kwargs, claude_scheduler.try_acquire)
+    request_kwargs["max_tokens"] = choose_max_tokens(request_type, input_tokens)
+    logger.info(f"Entrada: {input_tokens} tokens ({'contados' if exact else 'estimados'}), "
+                f"tipo {request_type}, max_tokens={request_kwargs['max_tokens']}")
+    return input_tokens, exact
+
+def record_token_usage(request_type, counted, response, max_tokens):
+    """Registra o `usage` da resposta e o retorna no formato salvo com a mensagem."""
+    if response is None or not getattr(response, 'usage', None):
+        return None
+    usage = usage_dict(response.usage, max_tokens, getattr(response, 'stop_reason', None))
+    token_accounting.record(request_type, counted[0], counted[1], usage)
+    return usage
+
+def run_tool_calls(content_blocks):
+    """Executa as chamadas de ferramenta da resposta e retorna os blocos de gráfico gerados."""
+    charts = []
+    for block in content_blocks:
+        if getattr(block, 'type', None) != 'tool_use':
+            continue
+        try:
+            charts.append(run_chart_tool(block.name, block.input))
+            logger.info(f"Ferramenta {block.name} executada: {json.dumps(block.input, ensure_ascii=False)}")
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Erro ao executar ferramenta {block.name}: {e}")
+    return charts
+
+THINKING_OPEN_TAG = "<thinking>"
+THINKING_CLOSE_TAG = "</thinking>"
+
+class ThinkingFilter:
+    """Remove as seções <thinking>...</thinking> de um texto que chega em pedaços.
+    
+    Com as ferramentas de gráfico, o modelo forte pode escrever o raciocínio
+    antes da chamada; esse texto não é mostrado ao usuário nem gravado. Uma
+    seção sem fechamento volta como texto em `close`.
+    """
+    
+    def __init__(self):
+        self._buffer = ""
+        self._in_thinking = False
+    
+    def feed(self, chunk):
+        self._buffer += chunk
+        output = []
+        while True:
+            if self._in_thinking:
+                end = self._buffer.find(THINKING_CLOSE_TAG)
+                if end == -1:
+                    break
+                self._buffer = self._buffer[end + len(THINKING_CLOSE_TAG):]
+                self._in_thinking = False
+            else:
+                start = self._buffer.find(THINKING_OPEN_TAG)
+                if start == -1:
+                    # Segurar um possível começo de tag no fim do buffer
+                    keep = next((size for size in range(min(len(THINKING_OPEN_TAG) - 1, len(self._buffer)), 0, -1)
+                                 if THINKING_OPEN_TAG.startswith(self._buffer[-size:])), 0)
+                    output.append(self._buffer[:len(self._buffer) - keep])
+                    self._buffer = self._buffer[len(self._buffer) - keep:]
+                    break
+                output.append(self._buffer[:start])
+                self._buffer = self._buffer[start + len(THINKING_OPEN_TAG):]
+                self._in_thinking = True
+        return "".join(output)
+    
+    def close(self):
+        rest = THINKING_OPEN_TAG + self._buffer if self._in_thinking else self._buffer
+        self._buffer = ""
+        self._in_thinking = False
+        return rest
+
+def strip_thinking(text):
+    """Texto sem as seções <thinking>...</thinking>."""
+    thinking_filter = ThinkingFilter()
+    return thinking_filter.feed(text) + thinking_filter.close()
+
+def render_claude_content(content_blocks):
+    """Texto final da resposta: blocos de texto (sem <thinking>) seguidos dos gráficos das ferramentas."""
+    text = strip_thinking("".join(block.text for block in content_blocks if getattr(block, 'type', None) == 'text'))
+    charts = run_tool_calls(content_blocks)
+    if charts:
+        text = "\n\n".join([text.rstrip()] + charts) if text.strip() else "\n\n".join(charts)
+    return text
+
+# Função para processar mensagem do Claude com timeout
+def process_claude_message(messages, prompt_cache=None, use_cache=False, summary=None, route=None):
+    """Envia o pedido ao Claude.
+
+    Com `use_cache`, uma resposta já guardada para o mesmo pedido é devolvida
+    sem chamar a API. `route` força a rota de modelo (fast | strong). A
+    chamada passa pelo `claude_scheduler`, que levanta ClaudeBusyError quando
+    a fila de saída está cheia.
+
     Returns:
-        dict or None: The parsed chart data or None if no valid data found
+        (texto da resposta, usage de tokens ou None se veio do cache)
     """
+    if prompt_cache is None:
+        prompt_cache = PROMPT_CACHE_ENABLED
+    request_kwargs = build_claude_request(messages, prompt_cache, summary, route)
+    cache_key = response_cache_key(request_kwargs, use_cache)
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Resposta servida do cache ({len(cached)} caracteres)")
+            return cached, None
+    request_type = classify_request(messages)
+    counted = apply_token_budget(request_kwargs, request_type)
+    
+    # Limites de RPM/TPM, retry-after e backoff ficam com o agendador
+    client = get_client().with_options(max_retries=0)
+    started = None
+    
+    def create():
+        nonlocal started
+        started = time.time()  # Latência do modelo, sem a espera na fila
+        return client.messages.create(**request_kwargs)
+    
     try:
-        if not text:
-            return None
-            
-        # First try to find data between [GRAFICO_DADOS] tags
-        start = text.find('[GRAFICO_DADOS]')
-        end = text.find('[/GRAFICO_DADOS]')
+        response = claude_scheduler.call(create, counted[0])
         
-        if start != -1 and end != -1 and end > start:
-            chart_json = text[start + 14:end].strip()
-            
-            try:
-                chart_data = json.loads(chart_json)
-                # Validate chart data structure
-                if not isinstance(chart_data, dict):
-                    return None
-                    
-                required_fields = ['type', 'title', 'years', 'initialValue', 'products']
-                missing_fields = [field for field in required_fields if field not in chart_data]
-                if missing_fields:
-                    return None
-                    
-                return chart_data
-            except json.JSONDecodeError:
-                return None
+        latency = time.time() - started
+        if response is not None and getattr(response, 'usage', None):
+            record_claude_usage(response.usage, latency, prompt_cache)
+        usage = record_token_usage(request_type, counted, response, request_kwargs["max_tokens"])
+        model_router_stats.record(request_kwargs["model"], latency, usage)
         
-        return None
-    except Exception:
-        return None
+        assistant_message = render_claude_content(response.content) if response and response.content else ""
+        logger.info(f"Resposta recebida do Claude: {len(assistant_message)} caracteres")
+        if not assistant_message:
+            raise Exception("Resposta vazia do Claude")
+        if cache_key:
+            response_cache.set(cache_key, assistant_message)
+        
+        return assistant_message, usage
+    finally:
+        # Limpeza de memória após receber resposta
+        gc.collect()
 
-# Função para processar mensagem do Claude com timeout
-def process_claude_message(messages, max_retries=1):
-    for attempt in range(max_retries):
+def resolve_document(pdf, request_id):
+    """Retorna o texto do PDF, extraindo-o só na primeira vez que o arquivo aparece.
+
+    O documento é identificado pelo SHA-256 do arquivo: um reenvio do mesmo PDF
+    (no mesmo chat ou em outro) reaproveita o texto salvo em `documents`.
+
+    Returns:
+        (texto, armazenado): `armazenado` é False se a linha em `documents` não
+        pôde ser gravada; nesse caso a mensagem não pode referenciar o documento
+    """
+    document = get_document(pdf['sha256'])
+    if document:
+        logger.info(f"[{request_id}] PDF {pdf['sha256'][:12]} já armazenado; extração ignorada")
+        return document['content'], True
+    
+    pdf_text = extract_pdf_text(pdf['path'])
+    stored = save_document(pdf['sha256'], pdf['filename'], os.path.getsize(pdf['path']), pdf_text)
+    if not stored:
+        logger.warning(f"[{request_id}] Não foi possível armazenar o PDF {pdf['sha256'][:12]}")
+    return pdf_text, stored
+
+def prepare_message_request(data, request_id, pdf=None):
+    """Valida o corpo de /api/message e monta o contexto enviado ao Claude.
+
+    Returns:
+        tuple: (turn, None) em caso de sucesso ou (None, (payload, status)) com o
+        erro a devolver ao cliente. `turn` traz chat_id, user_content (o texto
+        salvo no chat, sem o conteúdo do PDF), document_id e messages.
+    """
+    if not data:
+        return None, ({"success": False, "message": "Dados inválidos"}, 400)
+
+    chat_id = data.get('chatId')
+    message_content = data.get('message', '').strip()
+    
+    if not message_content and pdf:
+        message_content = "Analise o conteúdo do PDF anexado."
+    
+    if not message_content:
+        return None, ({"success": False, "message": "Mensagem vazia"}, 400)
+
+    # Verificar se é uma mensagem muito longa
+    if len(message_content) > 8000:  # Limitar tamanho da mensagem
+        return None, ({
+            "success": False,
+            "message": "Mensagem muito longa. Por favor, reduza o tamanho."
+        }, 400)
+
+    # Processar PDF se presente; o chat guarda só a referência ao documento
+    claude_content = message_content
+    document_id = None
+    if pdf:
         try:
-            # Obter o prompt do sistema
-            system_prompt = get_prompt()
-            logger.info(f"Prompt carregado: {system_prompt[:100] if system_prompt else 'NENHUM PROMPT ENCONTRADO'}...")
-            logger.info(f"Tamanho total do prompt: {len(system_prompt) if system_prompt else 0} caracteres")
-            
-            if not system_prompt:
-                logger.warning("Nenhum prompt do sistema encontrado, usando prompt padrão")
-                system_prompt = "Você é um assistente especializado em investimentos da Horizont Investimentos."
-            
-            # Verificar tamanho total das mensagens e limitar para 512MB RAM
-            total_tokens = len(system_prompt.split()) * 2  # Apenas o prompt do sistema
-            
-            # Ajustar max_tokens com base no tamanho da entrada (otimizado para 512MB RAM)
-            max_tokens = min(1024, max(256, total_tokens))  # Reduzido ainda mais
-            
-            # Ajustar temperatura com base no tipo de resposta
-            temp = 0.7
-            timeout = 45.0  # Reduzido para 45s para evitar worker timeout
-            
-            if any("[GRAFICO_DADOS]" in msg["content"] for msg in messages):
-                temp = 0.1  # Menor temperatura para respostas estruturadas
-                max_tokens = 1024  # Aumentado para 1024 para gráficos (era 768)
-                timeout = 45.0  # Reduzido para 45s para gráficos (era 90s)
-                logger.info(f"Detectado pedido de gráfico - usando timeout de {timeout}s e {max_tokens} tokens")
-            
-            logger.info(f"Enviando para Claude com system prompt: {len(system_prompt)} caracteres")
-            logger.info(f"Configuração: max_tokens={max_tokens}, temperature={temp}, timeout={timeout}s")
-            
-            response = client.messages.create(
-                model="claude-3-opus-20240229",
-                max_tokens=max_tokens,
-                messages=messages,
-                system=system_prompt,
-                temperature=temp,
-                timeout=timeout
-            )
-            
-            logger.info(f"Resposta recebida do Claude: {len(response.content[0].text) if response and response.content else 0} caracteres")
-            
-            # Limpeza de memória após receber resposta
-            gc.collect()
-            
-            return response
-            
-        except Exception as e:
-            logger.error(f"Tentativa {attempt + 1} falhou: {str(e)}")
-            if attempt == max_retries - 1:
-                raise
-            time.sleep(2)  # Espera 2 segundos antes de tentar novamente
-            gc.collect()  # Limpeza de memória entre tentativas
+            pdf_text, stored = resolve_document(pdf, request_id)
+        except PDFExtractionError as e:
+            logger.error(f"[{request_id}] Erro ao extrair texto do PDF: {e}")
+            status = 503 if isinstance(e, PDFPoolBusyError) else 400
+            return None, ({"success": False, "message": str(e)}, status)
+        # Sem a linha em `documents` a FK recusaria a mensagem e o turno se perderia
+        document_id = pdf['sha256'] if stored else None
+        if pdf_text:
+            # Só os trechos relevantes para a pergunta, dentro do orçamento de tokens
+            pdf_context = select_context(pdf_text, message_content, document_id=pdf['sha256'])
+            claude_content += f"\n\nConteúdo do PDF:\n{pdf_context}"
+
+    # Histórico recente dentro do orçamento de tokens + resumo dos turnos antigos
+    messages = []
+    summary = None
+    if chat_id:
+        messages, summary = conversation_memory.build(chat_id)
+    
+    # Adicionar nova mensagem
+    if messages and messages[-1]["role"] == "user":
+        # Turno anterior ficou sem resposta salva
+        messages[-1]["content"] += f"\n\n{claude_content}"
+    else:
+        messages.append({"role": "user", "content": claude_content})
+    
+    logger.info(f"[{request_id}] Enviando contexto: {len(messages)} mensagens")
+    return {
+        "chat_id": chat_id,
+        "user_content": message_content,
+        "document_id": document_id,
+        "messages": messages,
+        "summary": summary
+    }, None
+
+def save_turn(turn, assistant_message, usage=None):
+    """Persiste a pergunta e a resposta no chat sem derrubar a resposta em caso de erro.
+
+    Com WRITE_BEHIND_ENABLED o turno vai para o diário local e é gravado no
+    MySQL em segundo plano; se o diário falhar, grava direto no banco. `usage`
+    (tokens da resposta) é gravado na mensagem do assistente e somado ao usuário.
+    Os gráficos são gravados em JSON compacto e sem as séries mensais (o
+    frontend as recalcula), para a resposta caber nas colunas TEXT.
+    """
+    chat_id = turn["chat_id"]
+    if not chat_id:
+        return
+    assistant_message = compact_chart_blocks(assistant_message)
+    if WRITE_BEHIND_ENABLED:
+        try:
+            turn_journal.append(turn_messages(chat_id, turn["user_content"], assistant_message, turn["document_id"], usage))
+            logger.info(f"Turno do chat {chat_id} anotado no diário (write-behind)")
+            return
+        except Exception as journal_error:
+            logger.error(f"Erro no diário write-behind, gravando direto no banco: {journal_error}")
+    logger.info(f"Salvando mensagens no chat {chat_id}")
+    try:
+        if save_chat_turn(chat_id, turn["user_content"], assistant_message, document_id=turn["document_id"], usage=usage):
+            logger.info("Mensagens salvas com sucesso!")
+        else:
+            logger.error(f"Falha ao salvar o turno no chat {chat_id}")
+    except Exception as db_error:
+        logger.error(f"Erro ao salvar no banco: {db_error}")
+        # Não falhar a resposta por erro no banco
+
+# Memória da conversa (histórico com orçamento de tokens + resumo em chats.context)
+conversation_memory = ConversationMemory(lambda: get_client(), scheduler_call=claude_scheduler.call)
+
+# Diário do write-behind; o flusher só é iniciado com WRITE_BEHIND_ENABLED
+turn_journal = WriteBehindJournal(add_messages)
+
+def sse_event(event, payload):
+    """Formata um evento Server-Sent Events com payload JSON."""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
 @app.route('/')
 def index():
@@ -252,7 +673,9 @@ def login():
 def get_chats(username):
     try:
         logger.info(f"Buscando chats para usuário: {username}")
-        chats = get_user_chats(username)
+        # ?include=messages devolve o formato antigo, com o histórico de cada chat
+        include_messages = request.args.get('include') == 'messages'
+        chats = get_user_chats(username, include_messages=include_messages)
         return jsonify({"success": True, "chats": chats})
     except Exception as e:
         logger.error(f"Erro ao buscar chats: {e}")
@@ -277,6 +700,38 @@ def create_new_chat(username):
         logger.error(f"Erro ao criar chat: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route('/api/chats/<username>/<chat_id>/messages', methods=['GET'])
+def get_chat_history(username, chat_id):
+    """Histórico de um chat, paginado por keyset.
+
+    Sem `before` retorna as mensagens mais recentes; para carregar as
+    anteriores, repita a chamada com `before=<next_cursor>`.
+    """
+    try:
+        before = request.args.get('before')
+        limit = request.args.get('limit', MESSAGES_PAGE_DEFAULT, type=int)
+        logger.info(f"Buscando mensagens do chat {chat_id} do usuário {username} (before={before}, limit={limit})")
+        
+        try:
+            page = get_chat_messages_page(chat_id, username, before=before, limit=limit)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        
+        # Gráficos separados do texto, como nas respostas de /api/message
+        for msg in page['messages']:
+            if msg['role'] == 'assistant':
+                msg['content'], msg['charts'] = extract_charts(msg['content'])
+        
+        return jsonify({
+            "success": True,
+            "messages": page['messages'],
+            "has_more": page['has_more'],
+            "next_cursor": page['next_cursor']
+        })
+    except Exception as e:
+        logger.error(f"Erro ao buscar mensagens: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
 @app.route('/api/chats/<username>/<chat_id>', methods=['DELETE'])
 def delete_user_chat(username, chat_id):
     try:
@@ -294,80 +749,46 @@ def message():
         request_id = str(uuid.uuid4())
         logger.info(f"[{request_id}] Iniciando processamento de mensagem")
         
-        data = request.get_json()
-        if not data:
-            return jsonify({"success": False, "message": "Dados inválidos"}), 400
-
-        chat_id = data.get('chatId')
-        message_content = data.get('message', '').strip()
-        
-        if not message_content:
-            return jsonify({"success": False, "message": "Mensagem vazia"}), 400
-
-        # Verificar se é uma mensagem muito longa
-        if len(message_content) > 8000:  # Limitar tamanho da mensagem
-            return jsonify({
-                "success": False,
-                "message": "Mensagem muito longa. Por favor, reduza o tamanho."
-            }), 400
-
-        # Processar PDF se presente
-        pdf_data = data.get('pdfData')
-        if pdf_data:
-            pdf_text = extract_pdf_text(pdf_data)
-            if pdf_text:
-                message_content += f"\n\nConteúdo do PDF:\n{pdf_text}"
-
-        # Obter apenas a última mensagem do assistente como contexto (para referenciar dados)
-        messages = []
-        if chat_id:
-            chat_messages = get_chat_messages(chat_id)
-            if chat_messages and len(chat_messages) > 0:
-                # Pegar apenas a última mensagem do assistente (se existir)
-                last_assistant_msg = None
-                for msg in reversed(chat_messages):
-                    if msg["role"] == "assistant":
-                        last_assistant_msg = msg
-                        break
-                
-                if last_assistant_msg:
-                    messages.append({"role": "assistant", "content": last_assistant_msg["content"]})
-                    logger.info(f"[{request_id}] Incluindo última resposta do assistente como contexto")
-        
-        # Adicionar nova mensagem
-        messages.append({"role": "user", "content": message_content})
-        
-        logger.info(f"[{request_id}] Enviando contexto mínimo: {len(messages)} mensagens")
+        try:
+            data, pdf = read_message_payload()
+        except PDFExtractionError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        except RequestEntityTooLarge:
+            return jsonify({"success": False, "message": "Arquivo muito grande"}), 413
+        try:
+            turn, error = prepare_message_request(data, request_id, pdf)
+        finally:
+            if pdf:
+                os.unlink(pdf['path'])
+        if error:
+            payload, status = error
+            return jsonify(payload), status
 
         try:
             # Processar mensagem com retry e timeout
-            response = process_claude_message(messages)
-            
-            if not response or not response.content:
-                raise Exception("Resposta vazia do Claude")
-
-            assistant_message = response.content[0].text
+            assistant_message, usage = process_claude_message(
+                turn["messages"],
+                prompt_cache=data.get('promptCache'),
+                use_cache=use_response_cache(data),
+                summary=turn["summary"],
+                route=data.get('modelRoute')
+            )
             
-            # Salvar mensagens no banco de forma otimizada
-            if chat_id:
-                logger.info(f"Salvando mensagens no chat {chat_id}")
-                
-                # Salvar ambas as mensagens de uma vez para ser mais rápido
-                try:
-                    # Salvar em paralelo para ser mais rápido
-                    add_message_to_chat(chat_id, "user", message_content)
-                    add_message_to_chat(chat_id, "assistant", assistant_message)
-                    logger.info("Mensagens salvas com sucesso!")
-                except Exception as db_error:
-                    logger.error(f"Erro ao salvar no banco: {db_error}")
-                    # Não falhar a resposta por erro no banco
-                    pass
+            # Salvar mensagens no banco (texto original, com os blocos de gráfico)
+            save_turn(turn, assistant_message, usage)
             
+            text, charts = extract_charts(assistant_message)
             return jsonify({
                 "success": True,
-                "message": assistant_message
+                "message": text,
+                "charts": charts
             })
 
+        except ClaudeBusyError as e:
+            logger.warning(f"[{request_id}] Chamada ao Claude recusada: {e}")
+            response = jsonify({"success": False, "busy": True, "message": CLAUDE_BUSY_MESSAGE})
+            response.headers['Retry-After'] = str(max(1, round(e.retry_after)))
+            return response, 503
         except Exception as e:
             logger.error(f"[{request_id}] Erro ao processar mensagem: {str(e)}")
             return jsonify({
@@ -386,6 +807,204 @@ def message():
             "message": "Erro interno do servidor"
         }), 500
 
+@app.route('/api/message/stream', methods=['POST'])
+def message_stream():
+    """Versão em streaming de /api/message.
+
+    Envia os trechos de texto do Claude como Server-Sent Events à medida que
+    chegam (evento `delta`), seguido de `done` com a resposta completa. O turno
+    só é salvo no banco quando o stream termina com sucesso.
+    """
+    request_id = str(uuid.uuid4())
+    logger.info(f"[{request_id}] Iniciando processamento de mensagem (stream)")
+    
+    try:
+        data, pdf = read_message_payload()
+    except PDFExtractionError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except RequestEntityTooLarge:
+        return jsonify({"success": False, "message": "Arquivo muito grande"}), 413
+    try:
+        turn, error = prepare_message_request(data, request_id, pdf)
+    finally:
+        if pdf:
+            os.unlink(pdf['path'])
+    if error:
+        payload, status = error
+        return jsonify(payload), status
+    
+    prompt_cache = data.get('promptCache')
+    if prompt_cache is None:
+        prompt_cache = PROMPT_CACHE_ENABLED
+    use_cache = use_response_cache(data)
+
+    def generate():
+        started = time.time()
+        parts = []
+        # Os blocos [GRAFICO_DADOS] saem do texto e viram eventos `chart`
+        # assim que a tag de fechamento chega
+        chart_parser = ChartStreamParser()
+        text_parts = []
+
+        def parsed_events(chunk, final=False):
+            events = chart_parser.feed(chunk)
+            if final:
+                events += chart_parser.close()
+            for kind, value in events:
+                if kind == "chart":
+                    yield sse_event("chart", {"chart": value})
+                else:
+                    # Blocos inválidos seguem como texto, para o cliente vê-los
+                    text_parts.append(value)
+                    yield sse_event("delta", {"text": value})
+
+        try:
+            yield sse_event("start", {"requestId": request_id})
+            request_kwargs = build_claude_request(turn["messages"], prompt_cache, turn["summary"], data.get('modelRoute'))
+            cache_key = response_cache_key(request_kwargs, use_cache)
+            cached = response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                # Resposta inteira em um único delta
+                logger.info(f"[{request_id}] Resposta servida do cache ({len(cached)} caracteres)")
+                save_turn(turn, cached)
+                yield from parsed_events(cached, final=True)
+                yield sse_event("done", {
+                    "success": True,
+                    "message": "".join(text_parts).strip(),
+                    "charts": chart_parser.charts,
+                    "cached": True
+                })
+                return
+            
+            request_type = classify_request(turn["messages"])
+            counted = apply_token_budget(request_kwargs, request_type)
+            # O agendador só pode repetir a abertura do stream (antes do primeiro
+            # trecho); depois disso um erro vai direto para o cliente
+            client = get_client().with_options(max_retries=0)
+            thinking_filter = ThinkingFilter()
+            call_started = None
+            
+            def open_stream(stack):
+                nonlocal call_started
+                call_started = time.time()  # Latência do modelo, sem count_tokens nem fila
+                return stack.enter_context(client.messages.stream(**request_kwargs))
+            
+            with ExitStack() as stack:
+                stream = claude_scheduler.call(lambda: open_stream(stack), counted[0])
+                for text in stream.text_stream:
+                    text = thinking_filter.feed(text)
+                    if not text:
+                        continue
+                    if not parts:
+                        logger.info(f"[{request_id}] Primeiro token em {time.time() - call_started:.2f}s "
+                                    f"({time.time() - started:.2f}s desde o pedido)")
+                    parts.append(text)
+                    yield from parsed_events(text)
+                final_message = stream.get_final_message()
+                latency = time.time() - call_started
+            rest = thinking_filter.close()
+            if rest:
+                parts.append(rest)
+                yield from parsed_events(rest)
+            
+            # Gráficos pedidos via ferramenta chegam depois do texto
+            for chart in run_tool_calls(final_message.content):
+                chart_text = f"\n\n{chart}" if parts else chart
+                parts.append(chart_text)
+                yield from parsed_events(chart_text)
+            yield from parsed_events("", final=True)
+            
+            if getattr(final_message, 'usage', None):
+                record_claude_usage(final_message.usage, latency, prompt_cache)
+            usage = record_token_usage(request_type, counted, final_message, request_kwargs["max_tokens"])
+            model_router_stats.record(request_kwargs["model"], latency, usage)
+            
+            assistant_message = "".join(parts)
+            if not assistant_message:
+                raise Exception("Resposta vazia do Claude")
+            
+            if cache_key:
+                response_cache.set(cache_key, assistant_message)
+            save_turn(turn, assistant_message, usage)
+            logger.info(f"[{request_id}] Stream concluído em {time.time() - started:.2f}s")
+            if chart_parser.rejected:
+                logger.warning(f"[{request_id}] Blocos de gráfico inválidos enviados como texto: {chart_parser.rejected}")
+            yield sse_event("done", {
+                "success": True,
+                "message": "".join(text_parts).strip(),
+                "charts": chart_parser.charts
+            })
+        except ClaudeBusyError as e:
+            logger.warning(f"[{request_id}] Chamada ao Claude recusada: {e}")
+            yield sse_event("error", {
+                "success": False,
+                "busy": True,
+                "retryAfter": e.retry_after,
+                "message": CLAUDE_BUSY_MESSAGE
+            })
+        except Exception as e:
+            logger.error(f"[{request_id}] Erro no stream: {str(e)}")
+            yield sse_event("error", {
+                "success": False,
+                "message": "O servidor está temporariamente indisponível. Por favor, tente novamente em alguns instantes."
+            })
+        finally:
+            gc.collect()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Evitar buffering em proxies
+        }
+    )
+
+def is_json_number(value):
+    """True para números do JSON (booleanos não contam)."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+@app.route('/api/projections', methods=['POST'])
+def projections():
+    """Projeções de investimento calculadas no servidor (sem passar pelo Claude).
+
+    Corpo JSON: `initialValues` (lista) ou `initialValue`, `horizons` (lista de
+    anos) ou `years`, `products` (lista de nomes dos produtos padrão ou
+    dicionário nome -> {rate | monthlyRate}) e `frequency` (monthly | yearly).
+    Cada projeção volta no formato de [GRAFICO_DADOS], com a série calculada.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    try:
+        initial_values = data.get('initialValues') or [data.get('initialValue', 100000)]
+        if not isinstance(initial_values, list) or not all(is_json_number(value) for value in initial_values):
+            raise ValueError("initialValues deve ser uma lista de números")
+        horizons = data.get('horizons') or [data.get('years', 5)]
+        if not isinstance(horizons, list) or not all(
+                is_json_number(years) and float(years).is_integer() for years in horizons):
+            raise ValueError("horizons deve ser uma lista de anos inteiros")
+        
+        products = data.get('products') or DEFAULT_PRODUCTS
+        if isinstance(products, list):
+            if not all(isinstance(name, str) and name in DEFAULT_PRODUCTS for name in products):
+                raise ValueError(f"products deve listar produtos conhecidos: {', '.join(DEFAULT_PRODUCTS)}")
+            products = {name: DEFAULT_PRODUCTS[name] for name in products}
+        elif not isinstance(products, dict):
+            raise ValueError("products deve ser uma lista ou um dicionário")
+        
+        frequency = data.get('frequency', 'monthly')
+        if not isinstance(frequency, str):
+            raise ValueError("frequency deve ser 'monthly' ou 'yearly'")
+        
+        result = build_projections([float(value) for value in initial_values], [int(years) for years in horizons],
+                                   products, frequency)
+    except ValueError as e:
+        # Mensagens dos validadores acima e de chart_helper, nunca texto de exceção do Python
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    return jsonify({"success": True, "projections": result})
+
 @app.route('/api/admin/users', methods=['GET'])
 def get_users():
     try:
@@ -471,30 +1090,105 @@ def update_prompt_config():
         logger.error(f"Erro ao atualizar prompt: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
 
-@app.route('/health')
-def health_check():
-    """Health check endpoint for Render"""
+@app.route('/api/admin/stats', methods=['GET'])
+def get_stats():
+    """Métricas internas do processo (pool de conexões etc.)"""
     try:
-        # Test database connection
-        connection = get_db_connection()
-        if connection is None:
-            return jsonify({"status": "error", "message": "Database connection failed"}), 500
-        connection.close()
-        
-        # Test Claude API
-        try:
-            client.messages.create(
-                model="claude-3-opus-20240229",
-                max_tokens=10,
-                messages=[{"role": "user", "content": "Hi"}],
-                timeout=5  # Short timeout for health check
-            )
-        except Exception as e:
-            return jsonify({"status": "error", "message": f"Claude API check failed: {str(e)}"}), 500
-        
-        return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()})
+        return jsonify({
+            "success": True,
+            "pid": os.getpid(),
+            "database_pool": get_pool_stats(),
+            "prompt_cache": get_prompt_cache_stats(),
+            "claude_usage": get_usage_stats(),
+            "token_accounting": token_accounting.stats(),
+            "model_routing": model_router_stats.stats(),
+            "rate_limiter": claude_scheduler.stats(),
+            "boot": BOOT_TIMINGS,
+            "pdf_pool": pdf_pool.stats(),
+            "response_cache": response_cache.stats(),
+            "write_behind": turn_journal.stats() if WRITE_BEHIND_ENABLED else None
+        })
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.error(f"Erro ao buscar métricas: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route('/api/admin/token-usage', methods=['GET'])
+def get_token_usage():
+    """Tokens por usuário nos últimos `days` dias (padrão 30), somados no banco."""
+    try:
+        days = max(1, min(int(request.args.get('days', 30)), 365))
+    except ValueError:
+        return jsonify({"success": False, "message": "days inválido"}), 400
+    try:
+        return jsonify({"success": True, "days": days, "users": get_token_usage_by_user(days)})
+    except Exception as e:
+        logger.error(f"Erro ao buscar uso de tokens: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# Health checks: as dependências são verificadas em segundo plano e os
+# endpoints só devolvem o último resultado (sem tokens nem conexões por chamada)
+HEALTH_PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', 30))
+HEALTH_PROBE_TIMEOUT = float(os.getenv('HEALTH_PROBE_TIMEOUT', 5))
+HEALTH_PROBE_ENABLED = os.getenv('HEALTH_PROBE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+def check_database():
+    connection = get_db_connection()
+    if connection is None:
+        raise Exception("Database connection failed")
+    try:
+        connection.ping(reconnect=False)
+    finally:
+        connection.close()
+
+def check_claude():
+    # Listar modelos não é cobrado e confirma chave e conectividade
+    get_client().models.list(limit=1, timeout=HEALTH_PROBE_TIMEOUT)
+
+health_prober = DependencyProber(
+    {'database': check_database, 'claude': check_claude},
+    interval=HEALTH_PROBE_INTERVAL
+)
+
+@app.route('/health/live')
+def liveness_check():
+    """Liveness: o processo está de pé e atendendo"""
+    return jsonify({"success": True, "status": "alive", "timestamp": datetime.now().isoformat()})
+
+@app.route('/health/ready')
+@app.route('/health')
+def health_check():
+    """Readiness: último resultado das verificações de banco e Claude.
+
+    Só o banco decide se a instância está pronta; uma falha do Claude
+    aparece como `degraded`, já que lentidão da Anthropic não se resolve
+    reiniciando a instância. Com HEALTH_PROBE_ENABLED=false nada é verificado
+    e a instância é dada como pronta (`not_probed`).
+    """
+    if not HEALTH_PROBE_ENABLED:
+        return jsonify({
+            "success": True,
+            "status": "not_probed",
+            "checks": {},
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    checks = health_prober.snapshot()
+    database_ok = checks['database']['ok'] and not checks['database'].get('stale')
+    claude_ok = checks['claude']['ok'] and not checks['claude'].get('stale')
+    
+    if not database_ok:
+        status = "not_ready"
+    elif not claude_ok:
+        status = "degraded"
+    else:
+        status = "healthy"
+    
+    return jsonify({
+        "success": bool(database_ok),
+        "status": status,
+        "checks": checks,
+        "timestamp": datetime.now().isoformat()
+    }), (200 if database_ok else 503)
 
 @app.before_request
 def before_request():
@@ -543,7 +1237,10 @@ def handle_exception(e):
         "message": "Internal server error"
     }), 500
 
-# Adicionar handler para erros específicos do Gunicorn
+# Handler de sinais apenas para o servidor de desenvolvimento. Sob o Gunicorn
+# o próprio worker trata SIGTERM/SIGINT e espera as threads em andamento
+# terminarem; sobrescrever esses handlers mataria as requisições no meio.
+import atexit
 import signal
 import sys
 
@@ -551,12 +1248,31 @@ def signal_handler(signum, frame):
     logger.info(f"Recebido sinal {signum}, encerrando graciosamente...")
     sys.exit(0)
 
-signal.signal(signal.SIGTERM, signal_handler)
-signal.signal(signal.SIGINT, signal_handler)
+BOOT_TIMINGS['module_import'] = round(time.perf_counter() - _BOOT_STARTED, 4)
+logger.info(f"Módulo do servidor importado em {BOOT_TIMINGS['module_import']:.3f}s")
+
+# Aquecimento em segundo plano: roda no processo do worker (o app não é
+# pré-carregado pelo Gunicorn), sem bloquear o início do atendimento.
+# Processos do pool de PDF (spawn) reimportam o script principal como
+# __mp_main__ e não devem iniciar essas threads.
+_is_pool_child = __name__ == '__mp_main__'
+
+if not _is_pool_child and os.getenv('WARMUP_ON_BOOT', 'true').lower() in ('1', 'true', 'yes'):
+    threading.Thread(target=warmup, name='warmup', daemon=True).start()
+
+if not _is_pool_child and HEALTH_PROBE_ENABLED:
+    health_prober.start()
+
+if not _is_pool_child and WRITE_BEHIND_ENABLED:
+    # Regrava o que sobrou no diário e, ao sair, tenta esvaziá-lo
+    turn_journal.start()
+    atexit.register(turn_journal.stop)
 
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
     port = int(os.getenv('PORT', 8000))
     print("\n🚀 Servidor Horizont IA iniciado!")
     print(f"📍 Acesse: http://localhost:{port}")
     print("�� Login: admin/horizont2025")
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=True, threaded=True)
\ No newline at end of file
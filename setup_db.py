@@ -3,17 +3,10 @@ from mysql.connector import Error
 import os
 from dotenv import load_dotenv
 import bcrypt
+from migrate import apply_migrations
 
 load_dotenv()
 
-def check_table_exists(cursor, table_name):
-    try:
-        cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-        return cursor.fetchone() is not None
-    except Error as e:
-        print(f"Erro ao verificar tabela {table_name}: {e}")
-        return False
-
 def setup_database():
     try:
         # Conectar ao banco de dados
@@ -27,43 +20,12 @@ def setup_database():
 
         if connection.is_connected():
             print("Conexão estabelecida com sucesso!")
-            cursor = connection.cursor()
 
-            # Verificar se as tabelas já existem
-            tables_exist = all([
-                check_table_exists(cursor, 'users'),
-                check_table_exists(cursor, 'chats'),
-                check_table_exists(cursor, 'chat_messages'),
-                check_table_exists(cursor, 'prompts')
-            ])
+            cursor = connection.cursor()
 
-            if tables_exist:
-                print("Tabelas já existem, verificando dados...")
-                
-                # Verificar se existe algum usuário
-                cursor.execute("SELECT COUNT(*) FROM users")
-                user_count = cursor.fetchone()[0]
-                
-                # Verificar se existe algum prompt
-                cursor.execute("SELECT COUNT(*) FROM prompts")
-                prompt_count = cursor.fetchone()[0]
-                
-                if user_count > 0 and prompt_count > 0:
-                    print("Banco de dados já está configurado!")
-                    return
-                
-            # Se chegou aqui, precisa configurar o banco
-            print("\nExecutando script SQL...")
-            with open('setup_database.sql', 'r', encoding='utf-8') as sql_file:
-                sql_script = sql_file.read()
-                # Dividir o script em comandos individuais
-                sql_commands = sql_script.split(';')
-                
-                for command in sql_commands:
-                    if command.strip():
-                        print(f"\nExecutando comando:\n{command}")
-                        cursor.execute(command)
-                        print("Comando executado com sucesso!")
+            # Esquema: migrações versionadas, sem apagar dados existentes
+            print("\nAplicando migrações...")
+            apply_migrations(connection)
 
             # Criar usuário admin se não existir
             print("\nVerificando usuário admin...")
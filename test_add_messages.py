@@ -0,0 +1,102 @@
+"""
+Teste de `database.add_messages` com o cursor do mysql-connector.
+
+O cursor é o MySQLCursor real (mesma reescrita de executemany em INSERT de
+várias linhas e mesmo escape de parâmetros); só o envio ao servidor é
+trocado por uma lista dos comandos gerados.
+
+Uso:
+    python -m pytest -q test_add_messages.py
+"""
+
+from mysql.connector.conversion import MySQLConverter
+from mysql.connector.cursor import RE_PY_PARAM, MySQLCursor, _ParamSubstitutor
+
+import database
+
+class RecordingCursor(MySQLCursor):
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.statements = connection.statements
+
+    def execute(self, operation, params=None, multi=False):
+        if isinstance(operation, str):
+            operation = operation.encode(self._connection.python_charset)
+        if params is not None:
+            # Mesma substituição de parâmetros de MySQLCursor.execute
+            operation = RE_PY_PARAM.sub(_ParamSubstitutor(self._process_params(params)), operation)
+        operation = operation.decode(self._connection.python_charset)
+        self.statements.append(' '.join(operation.split()))
+        self._rowcount = 1
+        self._last_insert_id = 100
+        return None
+
+    @property
+    def lastrowid(self):
+        return 100
+
+class FakeConnection:
+    python_charset = 'utf8'
+    sql_mode = ''
+
+    def __init__(self):
+        self.converter = MySQLConverter('utf8mb4', True)
+        self.statements = []
+        self.committed = False
+
+    def is_connected(self):
+        return True
+
+    def handle_unread_result(self):
+        pass
+
+    def cursor(self, **kwargs):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+USAGE = {
+    'input_tokens': 1200,
+    'output_tokens': 300,
+    'cache_creation_input_tokens': 0,
+    'cache_read_input_tokens': 900,
+    'max_tokens': 1024,
+    'stop_reason': 'end_turn'
+}
+
+def test_turn_with_usage_is_saved(monkeypatch):
+    connection = FakeConnection()
+    monkeypatch.setattr(database, 'get_db_connection', lambda: connection)
+
+    messages = database.turn_messages('chat-1', 'Qual a taxa?', 'A taxa é 1% ao mês.', usage=USAGE)
+    assert database.add_messages(messages) is True
+    assert connection.committed
+
+    inserts = [s for s in connection.statements if s.startswith('INSERT INTO chat_messages')]
+    assert len(inserts) == 1  # As duas mensagens em um único INSERT de várias linhas
+    assert "'end_turn'" in inserts[0] and '1200' in inserts[0]
+
+    usage = [s for s in connection.statements if s.startswith('INSERT INTO user_token_usage')]
+    assert len(usage) == 1
+    assert "WHERE id = 'chat-1'" in usage[0]
+
+def test_usage_is_aggregated_per_chat(monkeypatch):
+    connection = FakeConnection()
+    monkeypatch.setattr(database, 'get_db_connection', lambda: connection)
+
+    truncated = dict(USAGE, stop_reason='max_tokens')
+    messages = (database.turn_messages('chat-1', 'a', 'b', usage=USAGE)
+                + database.turn_messages('chat-1', 'c', 'd', usage=truncated)
+                + database.turn_messages('chat-2', 'e', 'f'))
+    assert database.add_messages(messages) is True
+
+    usage = [s for s in connection.statements if s.startswith('INSERT INTO user_token_usage')]
+    assert len(usage) == 1
+    assert 'SELECT user_id, CURRENT_DATE, 2, 2400, 600, 0, 1800, 2048, 1' in usage[0]
@@ -0,0 +1,47 @@
+"""
+Testes dos blocos [GRAFICO_DADOS] em `chart_helper`.
+
+Uso:
+    python -m pytest -q test_chart_helper.py
+"""
+
+import json
+
+from chart_helper import (CHART_CLOSE_TAG, CHART_OPEN_TAG, ChartStreamParser, compact_chart_blocks,
+                          create_comparison_chart, create_product_chart, extract_charts)
+
+def test_compact_keeps_rejected_blocks():
+    text = 'Antes [GRAFICO_DADOS]{"title": "sem type"}[/GRAFICO_DADOS] depois'
+    assert compact_chart_blocks(text) == text
+
+def test_compact_drops_series_of_valid_blocks():
+    compacted = compact_chart_blocks("Veja:\n\n" + create_comparison_chart(1000, 2))
+    assert compacted.startswith("Veja:\n\n" + CHART_OPEN_TAG)
+    chart = json.loads(compacted[compacted.index(CHART_OPEN_TAG) + len(CHART_OPEN_TAG):-len(CHART_CLOSE_TAG)])
+    assert "series" not in chart
+    assert chart["initialValue"] == 1000
+
+def test_parser_accepts_monthly_rate_and_comments():
+    raw = ('{"type": "single", "title": "Projeção - Horizont Smart", "years": 5, "initialValue": 100000,\n'
+           ' "products": {"Horizont Smart": {\n'
+           '   "monthlyRate": 0.012,    // Taxa mensal em decimal\n'
+           '   "note": "http://exemplo"\n'
+           ' }}}')
+    text, charts = extract_charts(f"Veja {CHART_OPEN_TAG}{raw}{CHART_CLOSE_TAG}")
+    assert text == "Veja"
+    assert charts[0]["products"]["Horizont Smart"] == {"monthlyRate": 0.012, "note": "http://exemplo"}
+
+def test_rejected_blocks_stay_in_text():
+    block = f'{CHART_OPEN_TAG}{{"title": "sem type"}}{CHART_CLOSE_TAG}'
+    parser = ChartStreamParser()
+    events = parser.feed(f"Antes {block[:10]}") + parser.feed(f"{block[10:]} depois") + parser.close()
+    assert "".join(value for kind, value in events if kind != "chart") == f"Antes {block} depois"
+    assert parser.charts == [] and len(parser.rejected) == 1
+    assert extract_charts(f"Antes {block} depois") == (f"Antes {block} depois", [])
+
+def test_product_chart_rate_compounds_monthly():
+    chart = json.loads(create_product_chart("Horizont Leverage", 1000, 1, monthly_rate=0.02)[len(CHART_OPEN_TAG):-len(CHART_CLOSE_TAG)])
+    product = chart["products"]["Horizont Leverage"]
+    assert round(product["rate"], 2) == 26.82
+    # A série usa a mesma taxa que o frontend recalcula a partir de `rate`
+    assert chart["series"]["Horizont Leverage"][-1] == round(1000 * (1 + product["rate"] / 100), 2)
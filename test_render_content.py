@@ -0,0 +1,34 @@
+"""
+Testes do texto final das respostas do Claude em `server.py`.
+
+Uso:
+    python -m pytest -q test_render_content.py
+"""
+
+from types import SimpleNamespace
+
+import server
+from chart_helper import extract_charts
+
+def tool_use_response():
+    return [
+        SimpleNamespace(type='text', text="<thinking>O cliente quer comparar produtos; vou usar a ferramenta "
+                                          "grafico_comparativo.</thinking>\n\nVeja a comparação:"),
+        SimpleNamespace(type='tool_use', id='toolu_1', name='grafico_comparativo',
+                        input={'initial_value': 10000, 'years': 2, 'products': ['CDI', 'Poupança']})
+    ]
+
+def test_tool_use_reply_drops_thinking():
+    text, charts = extract_charts(server.render_claude_content(tool_use_response()))
+    assert text == "Veja a comparação:"
+    assert "thinking" not in text
+    assert list(charts[0]['products']) == ['CDI', 'Poupança']
+
+def test_thinking_filter_split_across_chunks():
+    thinking_filter = server.ThinkingFilter()
+    chunks = ["Oi <thi", "nking>raciocínio</thin", "king> tudo bem? <b>ok</b>"]
+    text = "".join(thinking_filter.feed(chunk) for chunk in chunks) + thinking_filter.close()
+    assert text == "Oi  tudo bem? <b>ok</b>"
+
+def test_unclosed_thinking_is_kept():
+    assert server.strip_thinking("Resposta <thinking>sem fim") == "Resposta <thinking>sem fim"
@@ -0,0 +1,135 @@
+"""
+Contabilidade de tokens das chamadas ao Claude.
+
+Antes de cada chamada os tokens de entrada são contados pela API
+(`messages.count_tokens`, com estimativa local se a contagem falhar) e o
+`max_tokens` sai do tipo do pedido (conversa, gráfico, PDF), limitado ao que
+resta da janela de contexto do modelo. Depois da resposta, o `usage` devolvido
+pela API é registrado por tipo: respostas cortadas (`stop_reason` igual a
+`max_tokens`) e orçamento de saída não usado ficam visíveis em
+`GET /api/admin/stats` para ajustar os limites. O mesmo `usage` é gravado na
+mensagem do assistente e somado por usuário no banco (`add_messages`).
+"""
+
+import json
+import logging
+import os
+import threading
+
+from retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PRECOUNT_ENABLED = os.getenv('TOKEN_PRECOUNT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+TOKEN_PRECOUNT_TIMEOUT = float(os.getenv('TOKEN_PRECOUNT_TIMEOUT', 0.8))  # Segundos, sem novas tentativas; depois disso, estimativa
+MODEL_CONTEXT_TOKENS = int(os.getenv('MODEL_CONTEXT_TOKENS', 200000))  # Janela de contexto do modelo
+MIN_OUTPUT_TOKENS = int(os.getenv('MIN_OUTPUT_TOKENS', 256))  # Piso do max_tokens
+
+# max_tokens por tipo de pedido
+MAX_OUTPUT_TOKENS = {
+    'chat': int(os.getenv('MAX_TOKENS_CHAT', 1024)),
+    'chart': int(os.getenv('MAX_TOKENS_CHART', 1024)),
+    'document': int(os.getenv('MAX_TOKENS_DOCUMENT', 1536))
+}
+
+USAGE_FIELDS = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+
+def estimate_request_tokens(request_kwargs):
+    """Estimativa local (caracteres / 4) de sistema, mensagens e ferramentas."""
+    def text_of(content):
+        if isinstance(content, str):
+            return content
+        return ''.join(block.get('text', '') for block in content if isinstance(block, dict))
+
+    text = text_of(request_kwargs.get('system') or '')
+    text += ''.join(text_of(m['content']) for m in request_kwargs.get('messages', []))
+    if request_kwargs.get('tools'):
+        text += json.dumps(request_kwargs['tools'], ensure_ascii=False)
+    return estimate_tokens(text)
+
+def count_input_tokens(client, request_kwargs, try_acquire=None):
+    """Tokens de entrada do pedido.
+
+    Args:
+        client: Cliente da Anthropic
+        request_kwargs: Parâmetros da chamada ao Claude
+        try_acquire: Função do agendador de saída que reserva a chamada de
+            contagem sem esperar (`OutboundScheduler.try_acquire`); sem
+            orçamento livre, vale a estimativa
+
+    Returns:
+        (tokens, exato): exato é False quando a contagem pela API está
+        desligada, sem orçamento ou falhou e o valor é a estimativa local
+    """
+    if TOKEN_PRECOUNT_ENABLED and (try_acquire is None or try_acquire()):
+        params = {key: request_kwargs[key] for key in ('model', 'messages', 'system', 'tools') if key in request_kwargs}
+        try:
+            # Uma tentativa só: a contagem atrasa a resposta e tem alternativa local
+            return client.with_options(max_retries=0).messages.count_tokens(
+                timeout=TOKEN_PRECOUNT_TIMEOUT, **params).input_tokens, True
+        except Exception as e:
+            logger.warning(f"Falha ao contar tokens pela API, usando estimativa: {e}")
+    return estimate_request_tokens(request_kwargs), False
+
+def choose_max_tokens(request_type, input_tokens, context_tokens=MODEL_CONTEXT_TOKENS):
+    """Orçamento de saída do tipo de pedido, sem passar do que resta da janela."""
+    ceiling = MAX_OUTPUT_TOKENS.get(request_type, MAX_OUTPUT_TOKENS['chat'])
+    remaining = context_tokens - input_tokens
+    return max(MIN_OUTPUT_TOKENS, min(ceiling, remaining))
+
+def usage_dict(usage, max_tokens, stop_reason):
+    """`usage` da API no formato gravado em chat_messages."""
+    result = {field: getattr(usage, field, 0) or 0 for field in USAGE_FIELDS}
+    result['max_tokens'] = max_tokens
+    result['stop_reason'] = stop_reason
+    return result
+
+class TokenAccounting:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, request_type, counted_tokens, counted_exact, usage):
+        """Acumula uma resposta do Claude. `usage` é o retorno de `usage_dict`."""
+        truncated = usage['stop_reason'] == 'max_tokens'
+        with self._lock:
+            stats = self._stats.setdefault(request_type, {
+                'requests': 0,
+                'input_tokens': 0,
+                'output_tokens': 0,
+                'cache_creation_input_tokens': 0,
+                'cache_read_input_tokens': 0,
+                'max_tokens': 0,
+                'truncated': 0,
+                'unused_output_tokens': 0,
+                'precounted': 0,
+                'estimated': 0,
+                'count_error_tokens': 0
+            })
+            stats['requests'] += 1
+            for field in USAGE_FIELDS:
+                stats[field] += usage[field]
+            stats['max_tokens'] += usage['max_tokens']
+            if truncated:
+                stats['truncated'] += 1
+            else:
+                stats['unused_output_tokens'] += max(0, usage['max_tokens'] - usage['output_tokens'])
+            stats['precounted' if counted_exact else 'estimated'] += 1
+            # Diferença entre a contagem prévia e a entrada cobrada (inclui cache)
+            billed_input = usage['input_tokens'] + usage['cache_creation_input_tokens'] + usage['cache_read_input_tokens']
+            stats['count_error_tokens'] += abs(billed_input - counted_tokens)
+
+        if truncated:
+            logger.warning(f"Resposta cortada em max_tokens={usage['max_tokens']} (tipo {request_type})")
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for request_type, stats in self._stats.items():
+                stats = dict(stats)
+                requests = stats['requests']
+                stats['truncated_rate'] = stats['truncated'] / requests if requests else 0.0
+                stats['output_budget_used'] = stats['output_tokens'] / stats['max_tokens'] if stats['max_tokens'] else 0.0
+                stats['max_tokens_limit'] = MAX_OUTPUT_TOKENS.get(request_type)
+                result[request_type] = stats
+            return result
@@ -0,0 +1,255 @@
+"""
+Gravação dos turnos no MySQL em segundo plano (write-behind).
+
+Cada turno é anotado em um diário SQLite local (em /tmp, que o Render monta
+como disco) e a resposta segue para o cliente sem esperar o MySQL. Uma thread
+junta os turnos pendentes em lotes e grava com `add_messages`, tentando de novo
+com espera crescente quando o banco falha. O que ficar no diário (queda do
+processo, MySQL fora do ar) é regravado quando o processo volta.
+
+Vários workers do Gunicorn podem compartilhar o mesmo arquivo: cada lote é
+reservado por um tempo (`lease`) antes de ir ao MySQL. A entrega é "pelo menos
+uma vez": se o processo morrer entre o commit no MySQL e a remoção do diário,
+o turno é gravado de novo.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+WRITE_BEHIND_JOURNAL = os.getenv('WRITE_BEHIND_JOURNAL', '/tmp/horizont-journal.sqlite3')
+WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', 1))  # Segundos entre lotes
+WRITE_BEHIND_BATCH = int(os.getenv('WRITE_BEHIND_BATCH', 50))  # Turnos por lote
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv('WRITE_BEHIND_MAX_BACKOFF', 60))  # Espera máxima após falhas
+# Tentativas antes de um turno ser separado como falho (fica no diário para inspeção)
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', 20))
+
+class WriteBehindJournal:
+    def __init__(self, flush_fn, path=WRITE_BEHIND_JOURNAL, interval=WRITE_BEHIND_INTERVAL,
+                 batch_size=WRITE_BEHIND_BATCH, max_backoff=WRITE_BEHIND_MAX_BACKOFF,
+                 max_attempts=WRITE_BEHIND_MAX_ATTEMPTS, lease=60.0):
+        """
+        Args:
+            flush_fn: Função que recebe a lista de mensagens e retorna True se gravou
+            path: Arquivo SQLite do diário
+        """
+        self.flush_fn = flush_fn
+        self.path = path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'appended': 0,
+            'flushed': 0,
+            'batches': 0,
+            'failures': 0,
+            'last_error': None,
+            'last_flush_at': None
+        }
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.execute("""
+                        CREATE TABLE IF NOT EXISTS pending_turns (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            payload TEXT NOT NULL,
+                            created_at REAL NOT NULL,
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            claimed_until REAL NOT NULL DEFAULT 0,
+                            failed INTEGER NOT NULL DEFAULT 0
+                        )
+                    """)
+                    self._initialized = True
+        connection.execute("PRAGMA synchronous=FULL")
+        return connection
+
+    def _incr(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def append(self, messages):
+        """Anota um turno (lista de mensagens) no diário; retorna quando está em disco."""
+        connection = self._connect()
+        try:
+            connection.execute(
+                "INSERT INTO pending_turns (payload, created_at) VALUES (?, ?)",
+                (json.dumps(messages, ensure_ascii=False), time.time())
+            )
+        finally:
+            connection.close()
+        self._incr('appended')
+        self._wakeup.set()
+
+    @staticmethod
+    def _execute_many(connection, sql, params):
+        # Conexão em autocommit: agrupar as linhas em uma única transação
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(sql, params)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _claim_batch(self, connection):
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute("""
+                SELECT id, payload, attempts FROM pending_turns
+                WHERE failed = 0 AND claimed_until < ?
+                ORDER BY id
+                LIMIT ?
+            """, (now, self.batch_size)).fetchall()
+            if rows:
+                connection.executemany(
+                    "UPDATE pending_turns SET claimed_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    [(now + self.lease, row[0]) for row in rows]
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return rows
+
+    def _write(self, rows):
+        """Grava as linhas do diário em uma chamada; retorna a mensagem de erro ou None."""
+        messages = []
+        for row in rows:
+            messages.extend(json.loads(row[1]))
+        try:
+            return None if self.flush_fn(messages) else "gravação no banco retornou falha"
+        except Exception as e:
+            return str(e)
+
+    def flush_once(self):
+        """Grava um lote no MySQL. Retorna o número de turnos gravados (-1 em caso de falha)."""
+        connection = self._connect()
+        try:
+            rows = self._claim_batch(connection)
+            if not rows:
+                return 0
+
+            error = self._write(rows)
+            done, failed = (rows, []) if error is None else ([], rows)
+            if error and len(rows) > 1:
+                # Um turno problemático (ex.: chat apagado) não pode travar o lote:
+                # tentar um a um antes de desistir
+                done, failed = [], []
+                for row in rows:
+                    (failed if self._write([row]) else done).append(row)
+
+            if done:
+                self._execute_many(connection, "DELETE FROM pending_turns WHERE id = ?", [(row[0],) for row in done])
+                self._incr('flushed', len(done))
+                self._incr('batches')
+                with self._stats_lock:
+                    self._stats['last_flush_at'] = time.time()
+
+            if failed:
+                # Liberar a reserva para a próxima tentativa. Se nada foi gravado o
+                # banco está fora do ar e ninguém é marcado; se outros turnos
+                # passaram, o problema é do turno, que após muitas tentativas é
+                # marcado como falho e sai da fila
+                max_attempts = self.max_attempts if done else float('inf')
+                self._execute_many(
+                    connection,
+                    "UPDATE pending_turns SET claimed_until = 0, failed = (attempts >= ?) WHERE id = ?",
+                    [(max_attempts, row[0]) for row in failed]
+                )
+                self._incr('failures')
+                with self._stats_lock:
+                    self._stats['last_error'] = error
+                logger.warning(f"Write-behind: falha ao gravar {len(failed)} de {len(rows)} turnos: {error}")
+                return -1 if not done else len(done)
+
+            return len(done)
+        finally:
+            connection.close()
+
+    def _run(self):
+        backoff = self.interval
+        while not self._stop.is_set():
+            try:
+                flushed = self.flush_once()
+            except Exception as e:
+                logger.error(f"Write-behind: erro no diário: {e}")
+                flushed = -1
+
+            if flushed < 0:
+                backoff = min(max(backoff * 2, self.interval), self.max_backoff)
+                self._stop.wait(backoff)
+                continue
+            backoff = self.interval
+            if flushed >= self.batch_size:
+                continue  # Ainda há fila: próximo lote sem esperar
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """Inicia o flusher; turnos que sobraram de execuções anteriores são regravados."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        pending = self.pending()
+        if pending:
+            logger.info(f"Write-behind: {pending} turnos pendentes no diário serão regravados")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def stop(self, flush=True, timeout=5.0):
+        """Para o flusher; com `flush`, tenta esvaziar o diário antes de sair."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if flush:
+            deadline = time.time() + timeout
+            while time.time() < deadline and self.flush_once() > 0:
+                pass
+
+    def pending(self):
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT COUNT(*) FROM pending_turns WHERE failed = 0").fetchone()[0]
+        finally:
+            connection.close()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        try:
+            connection = self._connect()
+            try:
+                count, oldest, failed = connection.execute("""
+                    SELECT SUM(failed = 0), MIN(CASE WHEN failed = 0 THEN created_at END), SUM(failed)
+                    FROM pending_turns
+                """).fetchone()
+            finally:
+                connection.close()
+            stats['pending'] = count or 0
+            stats['failed'] = failed or 0
+            stats['oldest_pending_age'] = round(time.time() - oldest, 1) if oldest else 0.0
+        except sqlite3.Error as e:
+            stats['pending'] = None
+            stats['journal_error'] = str(e)
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        return stats